@@ -0,0 +1,186 @@
+import argparse
+import io
+import json
+import math
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import piexif
+import PIL
+from PIL import Image
+from src.core.processor import ImageProcessor
+from src.core.watermark import WatermarkEngine
+from src.core.cache import SHADOW_CACHE, TEXT_SPRITE_CACHE
+from src.core.fonts import FONT_CACHE
+from src.core.exif import read_exif
+from src.core.utils import ProcessingSettings, Ratio, BlurMode, BorderStyle, WatermarkMode
+
+DEFAULT_SIZES = "2,12,24,50,100" # megapixels
+QUICK_SIZES = "2,12"
+DEFAULT_THRESHOLD = 0.15 # slower than baseline by more than this counts as a regression
+
+def make_source(megapixels: float) -> Image.Image:
+    """Deterministic-size 3:2 test image with enough detail for the resamplers to do real work."""
+    w = int(math.sqrt(megapixels * 1e6 * 3 / 2))
+    h = int(w * 2 / 3)
+    r = Image.effect_noise((w, h), 40)
+    g = Image.linear_gradient('L').resize((w, h))
+    b = Image.radial_gradient('L').resize((w, h))
+    return Image.merge('RGB', (r, g, b))
+
+def make_exif_jpeg() -> bytes:
+    exif = {"0th": {piexif.ImageIFD.Make: b"FUJIFILM", piexif.ImageIFD.Model: b"X100V"},
+            "Exif": {piexif.ExifIFD.ISOSpeedRatings: 200, piexif.ExifIFD.ExposureTime: (1, 250),
+                     piexif.ExifIFD.FNumber: (20, 10), piexif.ExifIFD.FocalLength: (230, 10)}}
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 64)).save(buffer, format='JPEG', exif=piexif.dump(exif))
+    return buffer.getvalue()
+
+def measure(func, repeat: int, setup=None, inner: int = 1) -> dict:
+    """Time func() repeat times (after setup() each time). Returns min / median seconds per call."""
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        for _ in range(inner):
+            func()
+        times.append((time.perf_counter() - start) / inner)
+    return {'min': min(times), 'median': statistics.median(times)}
+
+def clear_text_caches():
+    FONT_CACHE.clear()
+    TEXT_SPRITE_CACHE.clear()
+
+def run_benchmarks(sizes: list, repeat: int, log=print) -> dict:
+    processor = ImageProcessor()
+    engine = WatermarkEngine()
+    results = {}
+
+    def record(name, value):
+        results[name] = value
+        log(f"{name:<52} {value['min'] * 1000:10.3f} ms")
+
+    # Size-independent: EXIF parsing
+    jpeg = make_exif_jpeg()
+    exif_image = Image.open(io.BytesIO(jpeg))
+    # A temp file, not the source tree (which may be read-only)
+    fd, exif_path = tempfile.mkstemp(suffix=".jpg", prefix="adaptive_glass_bench_")
+    with os.fdopen(fd, 'wb') as f:
+        f.write(jpeg)
+    try:
+        record("get_exif_data", measure(lambda: engine.get_exif_data(exif_image), repeat, inner=200))
+        record("read_exif", measure(lambda: read_exif(exif_path), repeat, inner=200))
+    finally:
+        os.remove(exif_path)
+    exif_data = engine.get_exif_data(exif_image)
+
+    for mp in sizes:
+        image = make_source(mp)
+        for ratio in Ratio:
+            settings = ProcessingSettings()
+            settings.target_ratio = ratio
+            prefix = f"{mp:g}MP/{ratio.name}"
+
+            record(f"target_size/{prefix}",
+                   measure(lambda: processor._calculate_target_size(image.size, ratio), repeat, inner=10000))
+            target_w, target_h = processor._calculate_target_size(image.size, ratio)
+            _, _, new_w, new_h = processor._calculate_content_rect(image.size, target_w, target_h, settings)
+
+            for mode in BlurMode:
+                settings.blur_mode = mode
+                record(f"background/{prefix}/{mode.name}",
+                       measure(lambda: processor._create_background(image, target_w, target_h, settings), repeat))
+            settings.blur_mode = BlurMode.STANDARD
+
+            record(f"foreground_resize/{prefix}",
+                   measure(lambda: image.resize((new_w, new_h), Image.Resampling.LANCZOS), repeat))
+            foreground = image.resize((new_w, new_h), Image.Resampling.LANCZOS)
+
+            for border in BorderStyle:
+                settings.border_style = border
+                record(f"border/{prefix}/{border.name}",
+                       measure(lambda: processor._apply_border(foreground, settings), repeat))
+                # Every style, including the default borderless one
+                record(f"shadow/{prefix}/{border.name}",
+                       measure(lambda: processor._create_shadow(new_w, new_h, settings), repeat,
+                               setup=SHADOW_CACHE.clear))
+            settings.border_style = BorderStyle.NONE
+            del foreground
+
+            canvas = Image.new('RGB', (target_w, target_h), (40, 40, 40))
+            layout_info = {'target_size': (target_w, target_h), 'content_rect': (0, 0, target_w, target_h)}
+            settings.watermark.enabled = True
+            settings.watermark.text_mode = WatermarkMode.FALLBACK
+            render = lambda: engine.render_watermark(canvas, settings.watermark, exif_data, layout_info)
+            record(f"watermark/{prefix}", measure(render, repeat, setup=clear_text_caches))
+            record(f"watermark_warm/{prefix}", measure(render, repeat))
+            del canvas
+        del image
+    return results
+
+def compare(results: dict, baseline: dict, threshold: float, log=print) -> list:
+    """Print stage timings against the baseline. Returns the regressed entries."""
+    regressions = []
+    log(f"\n{'项目':<52} {'基线 ms':>10} {'当前 ms':>10} {'变化':>8}")
+    for name, value in results.items():
+        if name not in baseline:
+            continue
+        base = baseline[name]['min']
+        current = value['min']
+        change = (current - base) / base if base > 0 else 0.0
+        flag = ""
+        if change > threshold:
+            flag = "  <-- 变慢"
+            regressions.append((name, base, current, change))
+        log(f"{name:<52} {base * 1000:10.3f} {current * 1000:10.3f} {change:+8.1%}{flag}")
+    return regressions
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Adaptive Glass 处理管线各阶段性能基准")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help=f"源图尺寸 (百万像素，逗号分隔，默认 {DEFAULT_SIZES})")
+    parser.add_argument("--quick", action="store_true", help=f"快速模式，仅测试 {QUICK_SIZES} MP")
+    parser.add_argument("--repeat", type=int, default=3, help="每项重复次数，取最小值 (默认 3)")
+    parser.add_argument("--output", help="将结果写入 JSON 文件")
+    parser.add_argument("--baseline", help="与之前保存的 JSON 结果对比")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="超过基线多少比例算作变慢 (默认 0.15)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    sizes = [float(s) for s in (QUICK_SIZES if args.quick else args.sizes).split(",")]
+
+    results = run_benchmarks(sizes, args.repeat)
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'pillow': PIL.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'time': time.strftime("%Y-%m-%d %H:%M:%S"),
+            'sizes': sizes,
+            'repeat': args.repeat
+        },
+        'results': results
+    }
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\n结果已保存: {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} 项比基线慢 {args.threshold:.0%} 以上")
+            return 1
+        print("\n没有发现性能回退")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
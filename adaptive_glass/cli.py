@@ -0,0 +1,152 @@
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from src.core.batch import BatchRunner, collect_images, parse_ratios, ratio_variants, RATIO_LABELS, DEFAULT_IO_THREADS
+from src.core.preset_manager import PresetManager
+from src.core.profiling import TraceRecorder
+from src.core.memory import MemoryReport, MEMORY_REPORT_NAME
+from src.core.watch import FolderWatcher, DEFAULT_POLL_INTERVAL, output_inside_input
+from src.core.utils import ProcessingSettings
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Adaptive Glass 命令行批量处理 (无需图形界面)")
+    parser.add_argument("input_dir", help="输入图片目录")
+    parser.add_argument("output_dir", help="输出目录")
+    parser.add_argument("--preset", help="预设文件 (.agp)，不指定则使用默认设置")
+    parser.add_argument("--workers", type=int, default=None, help="并行数量 (默认: CPU 核心数)")
+    parser.add_argument("--backend", choices=BatchRunner.BACKENDS, default="thread", help="并行方式: thread 线程池 / process 进程池")
+    parser.add_argument("--tile-mb", type=int, default=None, help="超大图片分块渲染的内存预算 (MB)，超出时按水平条带处理")
+    parser.add_argument("--memory-mb", type=int, default=None, help="同时处理的图片预计内存上限 (MB，默认 4096)，超出时排队等待")
+    parser.add_argument("--io-threads", type=int, default=DEFAULT_IO_THREADS,
+                        help=f"读取和写入文件的线程数 (各自独立，默认 {DEFAULT_IO_THREADS})，网络共享盘可适当调大")
+    parser.add_argument("--force", action="store_true", help="忽略输出目录中的处理记录，全部重新处理")
+    parser.add_argument("--suffix", default="_processed", help="输出文件名后缀")
+    parser.add_argument("--ratios", help=f"多比例输出: 每张图片只解码一次，按逗号分隔的比例各输出一张 (可选: {', '.join(RATIO_LABELS.values())})，文件名附加比例")
+    parser.add_argument("--presets", nargs="+", metavar="PRESET", help="多预设输出: 每张图片只解码一次，按每个预设各输出一张，文件名附加预设名")
+    parser.add_argument("--format", dest="out_format", choices=["Auto", "PNG", "JPG"], default="Auto", help="输出格式")
+    parser.add_argument("--watch", action="store_true", help="监视模式: 持续处理输入目录中新写入完成的图片，按 Ctrl+C 退出")
+    parser.add_argument("--trace", help="记录每张图片各处理阶段的耗时，保存为 Chrome trace 文件 (.json，可在 chrome://tracing 或 ui.perfetto.dev 打开)")
+    parser.add_argument("--memory-report", action="store_true", help=f"记录每张图片的峰值内存，结束后在输出目录生成 {MEMORY_REPORT_NAME} 并列出占用最高的图片")
+    parser.add_argument("--interval", type=float, default=DEFAULT_POLL_INTERVAL, help="监视模式的扫描间隔 (秒)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if not os.path.isdir(args.input_dir):
+        print(f"输入目录不存在: {args.input_dir}")
+        return 2
+
+    settings = PresetManager.load_preset(args.preset) if args.preset else ProcessingSettings()
+    try:
+        variants = fanout_variants(args, settings)
+    except ValueError as e:
+        print(e)
+        return 2
+    runner_options = dict(workers=args.workers, backend=args.backend,
+                          tile_budget=args.tile_mb * 1024 * 1024 if args.tile_mb else None,
+                          memory_budget=args.memory_mb * 1024 * 1024 if args.memory_mb else None,
+                          readers=args.io_threads, writers=args.io_threads, resume=not args.force,
+                          tracer=TraceRecorder() if args.trace else None,
+                          memory_report=MemoryReport(settings) if args.memory_report else None,
+                          variants=variants)
+
+    if args.watch:
+        if output_inside_input(args.input_dir, args.output_dir):
+            print("监视模式下输出目录不能是输入目录或其子目录 (输出会被再次处理)")
+            return 2
+        os.makedirs(args.output_dir, exist_ok=True)
+        return watch(args, settings, runner_options)
+
+    files = collect_images(args.input_dir)
+    if not files:
+        print("没有找到可处理的图片")
+        return 0
+
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    runner = BatchRunner(files, args.output_dir, settings, args.suffix, args.out_format, **runner_options)
+
+    def on_progress(completed, total):
+        print(f"\r处理中: {completed}/{total}", end="", flush=True)
+
+    start = time.perf_counter()
+    try:
+        summary = runner.run(progress_callback=on_progress)
+    except KeyboardInterrupt:
+        runner.stop()
+        print("\n已中断")
+        save_trace(args, runner_options)
+        print_memory_report(args, runner_options)
+        return 130
+    elapsed = time.perf_counter() - start
+
+    print(f"\n完成: {summary['succeeded']}/{summary['total']} 张, 用时 {elapsed:.1f}s ({runner.backend} x{runner.workers})")
+    if summary['skipped']:
+        print(f"跳过 {summary['skipped']} 张 (输出已是最新)")
+    for path, error in summary['failed']:
+        print(f"失败: {path}: {error}")
+    save_trace(args, runner_options)
+    print_memory_report(args, runner_options)
+
+    return 1 if summary['failed'] else 0
+
+def fanout_variants(args, settings):
+    """(label, settings) per output of --ratios / --presets, or None for a single output."""
+    if args.ratios and args.presets:
+        raise ValueError("--ratios 和 --presets 不能同时使用")
+    if args.ratios:
+        return ratio_variants(settings, parse_ratios(args.ratios))
+    if args.presets:
+        variants = []
+        for path in args.presets:
+            if not os.path.isfile(path):
+                raise ValueError(f"预设文件不存在: {path}")
+            variants.append((os.path.splitext(os.path.basename(path))[0], PresetManager.load_preset(path)))
+        return variants
+    return None
+
+def watch(args, settings, runner_options):
+    watcher = FolderWatcher(args.input_dir, args.output_dir, settings, args.suffix, args.out_format,
+                            interval=args.interval, **runner_options)
+
+    def on_file(path, error):
+        stamp = time.strftime("%H:%M:%S")
+        if error:
+            print(f"[{stamp}] 失败: {path}: {error}")
+        else:
+            print(f"[{stamp}] 完成: {os.path.basename(path)}")
+
+    print(f"正在监视: {args.input_dir} -> {args.output_dir} (Ctrl+C 退出)")
+    try:
+        watcher.run(file_callback=on_file)
+    except KeyboardInterrupt:
+        watcher.stop()
+        print("已停止监视")
+    finally:
+        save_trace(args, runner_options)
+        print_memory_report(args, runner_options)
+    return 0
+
+def save_trace(args, runner_options):
+    tracer = runner_options['tracer']
+    if tracer is None:
+        return
+    try:
+        tracer.save(args.trace)
+        print(f"耗时记录已保存: {args.trace}")
+    except OSError as e:
+        print(f"无法保存耗时记录: {e}")
+
+def print_memory_report(args, runner_options):
+    report = runner_options['memory_report']
+    if report is None:
+        return
+    print(report.summary())
+    print(f"内存记录已保存: {os.path.join(args.output_dir, MEMORY_REPORT_NAME)}")
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
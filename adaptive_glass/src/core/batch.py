@@ -0,0 +1,526 @@
+import io
+import os
+import signal
+import collections
+import contextlib
+import concurrent.futures
+from dataclasses import replace
+from PIL import Image
+from .pipeline import RenderPipeline
+from .cache import SHADOW_CACHE, TEXT_SPRITE_CACHE, image_nbytes
+from .exif import EXIF_CACHE
+from .manifest import BatchManifest, content_hash, content_hash_file
+from .profiling import StageProfiler, TraceRecorder
+from .memory import MemoryProbe, MemoryReport, MEMORY_REPORT_NAME
+from .utils import ProcessingSettings, Ratio
+
+SUPPORTED_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
+DEFAULT_MEMORY_BUDGET_MB = 4096
+DEFAULT_IO_THREADS = 2
+MAX_CACHE_RESERVE_FRACTION = 0.125 # of the memory budget
+
+# Output name tags of fan-out ratios
+RATIO_LABELS = {
+    Ratio.R_1_1: "1x1", Ratio.R_4_3: "4x3", Ratio.R_16_9: "16x9", Ratio.R_9_16: "9x16",
+    Ratio.R_2_35_1: "2.35x1", Ratio.R_3_2: "3x2", Ratio.ORIGINAL: "original"
+}
+
+def collect_images(input_dir: str) -> list:
+    """List supported image files in a directory (non-recursive, sorted)."""
+    files = []
+    for entry in sorted(os.listdir(input_dir)):
+        path = os.path.join(input_dir, entry)
+        if os.path.isfile(path) and entry.lower().endswith(SUPPORTED_EXTENSIONS):
+            files.append(path)
+    return files
+
+def build_output_path(path: str, output_dir: str, suffix: str = "_processed", out_format: str = "Auto") -> str:
+    """Build the output file path for a source image."""
+    filename = os.path.basename(path)
+    name, ext = os.path.splitext(filename)
+
+    # Determine output format and extension
+    save_ext = ext
+    if out_format == "PNG":
+        save_ext = ".png"
+    elif out_format == "JPG":
+        save_ext = ".jpg"
+
+    return os.path.join(output_dir, f"{name}{suffix}{save_ext}")
+
+def encode_image(image: Image.Image, save_path: str, quality: int = 95) -> bytes:
+    """Encode an image in the format of save_path's extension, flattening alpha for JPEG."""
+    ext = os.path.splitext(save_path)[1].lower()
+    buffer = io.BytesIO()
+    if ext in ['.jpg', '.jpeg']:
+        if image.mode == 'RGBA':
+            image = image.convert('RGB')
+        image.save(buffer, format='JPEG', quality=quality)
+    else:
+        image.save(buffer, format=Image.registered_extensions().get(ext))
+    return buffer.getvalue()
+
+def save_image(image: Image.Image, save_path: str, quality: int = 95):
+    """Save an image, flattening alpha for JPEG output."""
+    write_file(save_path, encode_image(image, save_path, quality))
+
+def header_size(source) -> tuple:
+    """Image size from the file header (source is a path or a file object), or None
+    if it cannot be read."""
+    try:
+        with Image.open(source) as img:
+            return img.size
+    except Exception:
+        # Unreadable files fail fast in render_file
+        return None
+
+def read_file(path: str, with_exif: bool = False, keep_data: bool = True) -> tuple:
+    """Reader stage. Returns (raw bytes, EXIF from the header cache if requested,
+    content hash, stat, image size from the header) - hash and stat for the batch
+    manifest, the size for the memory estimate.
+
+    Without keep_data the file is only hashed, in chunks, and None is returned for
+    the bytes (for compute stages that read the file themselves).
+    """
+    with open(path, 'rb') as f:
+        stat = os.fstat(f.fileno())
+        if keep_data:
+            data = f.read()
+            digest = content_hash(data)
+            source_size = header_size(io.BytesIO(data))
+        else:
+            data = None
+            digest = content_hash_file(f)
+            f.seek(0)
+            source_size = header_size(f)
+    return data, EXIF_CACHE.get(path) if with_exif else None, digest, stat, source_size
+
+def write_file(save_path: str, data: bytes):
+    """Writer stage."""
+    with open(save_path, 'wb') as f:
+        f.write(data)
+
+def job_geometry(source_size: tuple, settings: ProcessingSettings, pipeline: RenderPipeline) -> tuple:
+    """(source size, target size, estimated peak bytes) of one file, from its header size.
+
+    Sizes are None and the estimate 0 if the header could not be read (source_size None).
+    """
+    processor = pipeline.processor
+    if source_size is None:
+        return None, None, 0
+
+    target_size = processor._calculate_target_size(source_size, settings.target_ratio)
+    content_rect = processor._calculate_content_rect(source_size, *target_size, settings)
+    estimate = processor.estimate_render_bytes(source_size, target_size, content_rect)
+
+    if pipeline.tile_budget is not None and estimate > pipeline.tile_budget:
+        # Tiled: source, output canvas and one strip's intermediates
+        estimate = source_size[0] * source_size[1] * 4 + target_size[0] * target_size[1] * 4 + pipeline.tile_budget
+    return source_size, target_size, estimate
+
+def variant_suffix(suffix: str, label: str = None) -> str:
+    """Output name suffix of a fan-out variant, e.g. "_processed_16x9"."""
+    return f"{suffix}_{label}" if label else suffix
+
+def ratio_variants(settings: ProcessingSettings, ratios) -> list:
+    """Fan-out variants [(label, settings)] of settings, one per target ratio."""
+    snapshot = settings.snapshot()
+    return [(RATIO_LABELS[ratio], replace(snapshot, target_ratio=ratio)) for ratio in ratios]
+
+def parse_ratios(text: str) -> list:
+    """Ratios from a comma-separated list of labels such as "1x1,16x9,9x16"."""
+    by_label = {label: ratio for ratio, label in RATIO_LABELS.items()}
+    ratios = []
+    for label in text.replace(" ", "").split(","):
+        if label:
+            if label.lower() not in by_label:
+                raise ValueError(f"未知比例: {label} (可选: {', '.join(by_label)})")
+            ratios.append(by_label[label.lower()])
+    if not ratios:
+        raise ValueError("没有指定比例")
+    return ratios
+
+def render_file(path: str, data: bytes, output_dir: str, settings: ProcessingSettings,
+                suffix: str = "_processed", out_format: str = "Auto",
+                pipeline: RenderPipeline = None, exif_data: dict = None, timings: list = None) -> tuple:
+    """Compute stage: decode the file's bytes, render and encode. Returns (save_path, encoded bytes).
+
+    Module-level so it can be submitted to a process pool. exif_data, when given,
+    saves the watermark stage from parsing the file's EXIF again. If a timings list
+    is given, the StageProfiler entries of decode, every render stage and encode
+    are appended to it.
+    """
+    return render_variants(path, data, output_dir, [(None, settings)], suffix, out_format,
+                           pipeline, exif_data, timings)[0]
+
+def render_variants(path: str, data: bytes, output_dir: str, variants: list,
+                    suffix: str = "_processed", out_format: str = "Auto",
+                    pipeline: RenderPipeline = None, exif_data: dict = None, timings: list = None) -> list:
+    """Fan-out compute stage: decode once, then render and encode one output per
+    (label, settings) variant (see RenderPipeline.render_many). A variant labelled
+    None is saved under the plain suffix. Returns [(save_path, encoded bytes)].
+    """
+    if pipeline is None:
+        pipeline = RenderPipeline()
+    profiler = StageProfiler() if timings is not None else None
+    # Without a profiler the stage blocks just get a throwaway entry
+    stage = profiler.stage if profiler is not None else lambda name: contextlib.nullcontext({})
+
+    with stage("decode") as entry:
+        try:
+            img = Image.open(io.BytesIO(data))
+            if profiler is not None or len(variants) > 1:
+                # Decode here rather than lazily inside the first render stage
+                img.load()
+                entry['bytes'] = image_nbytes(img)
+        except Exception as e:
+            raise IOError(f"Cannot load image {path}") from e
+
+    outputs = []
+    renders = pipeline.render_many(img, [settings for _, settings in variants], exif_data, profiler=profiler)
+    for (label, settings), (processed, layout_info) in zip(variants, renders):
+        save_path = build_output_path(path, output_dir, variant_suffix(suffix, label), out_format)
+        # Encoding is CPU work, and the encoded file is far smaller than the canvas
+        # handed between stages (or processes)
+        with stage("encode") as entry:
+            encoded = encode_image(processed, save_path, settings.export_quality)
+            entry['bytes'] = len(encoded)
+        outputs.append((save_path, encoded))
+        # Explicit cleanup
+        del processed
+
+    if profiler is not None:
+        timings.extend(profiler.timings)
+
+    del img
+    return outputs
+
+def write_outputs(outputs: list):
+    """Writer stage for [(save_path, encoded bytes)]."""
+    for save_path, encoded in outputs:
+        write_file(save_path, encoded)
+
+# Per-process state of process-pool workers, set once by _init_worker
+_worker_job = None
+
+def _init_worker(output_dir: str, variants: list, suffix: str, out_format: str, tile_budget: int):
+    """Process-pool initializer: build the engines once and keep the settings snapshots."""
+    global _worker_job
+    # Ctrl+C is handled by the parent, which shuts the pool down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _worker_job = (output_dir, variants, suffix, out_format, RenderPipeline(tile_budget=tile_budget))
+
+def _render_job(trace: bool, measure_memory: bool, *args) -> tuple:
+    """render_variants for the compute pool.
+
+    Returns (outputs, timings or None, MemoryProbe result or None).
+    """
+    timings = [] if trace else None
+    if not measure_memory:
+        return render_variants(*args, timings=timings), timings, None
+    with MemoryProbe() as probe:
+        outputs = render_variants(*args, timings=timings)
+    return outputs, timings, probe.result
+
+def _render_in_worker(path: str, exif_data: dict = None, trace: bool = False,
+                      measure_memory: bool = False) -> tuple:
+    output_dir, variants, suffix, out_format, pipeline = _worker_job
+    # The file is read twice: the parent's reader threads hash it, then the worker
+    # reads it again, normally from the OS page cache (a 20 MB file: ~4 ms) - far
+    # cheaper than pickling the bytes through the pool (~50 ms, on the parent too)
+    with open(path, 'rb') as f:
+        data = f.read()
+    return _render_job(trace, measure_memory, path, data, output_dir, variants, suffix, out_format, pipeline, exif_data)
+
+def _traced_io(tracer: TraceRecorder, name: str, path: str, func, *args):
+    """Run an I/O stage function and add its timing to the trace."""
+    profiler = StageProfiler()
+    with profiler.stage(name) as entry:
+        result = func(*args)
+        if name == "read":
+            entry['bytes'] = result[3].st_size
+        else:
+            entry['bytes'] = sum(len(encoded) for _, encoded in args[0])
+    tracer.add(profiler.timings, file=path)
+    return result
+
+class BatchRunner:
+    """Qt-free batch engine: reader -> compute -> writer stages with bounded queues.
+
+    Readers prefetch raw file bytes (and EXIF) on I/O threads, compute runs decode +
+    render + encode on a thread or process pool, writers save the encoded files.
+    Readers also hash each file and probe its header once, so the coordinator does
+    no file I/O. With the process backend the readers drop the bytes and each
+    worker reads its file again, normally from the OS page cache, so no file
+    content is pickled between processes.
+    Each stage has its own concurrency, so slow disks or network shares overlap
+    with rendering instead of stalling it. At most queue_size files wait between
+    two stages.
+
+    Jobs enter compute in order while the sum of their estimated peak memory fits
+    memory_budget (bytes), so many small files run in parallel while huge ones run
+    a few at a time. A job larger than the whole budget still runs, alone. The
+    process-wide caches that rendering fills (shadow masks, text sprites) are
+    reserved out of the budget, once per rendering process but at most 1/8 of the
+    budget: caches rarely fill up, and many workers must not starve admission.
+
+    Finished outputs are recorded in a manifest in output_dir; with resume, files
+    whose output is still current (same content, same settings) are skipped.
+
+    With a TraceRecorder as tracer, every stage of every file (read, decode, each
+    render stage, encode, write) is added to it, for export as a Chrome trace.
+    With a MemoryReport as memory_report, each image's peak memory is measured
+    (see MemoryProbe) and the report is saved to output_dir after the run.
+
+    variants, a list of (label, settings) such as ratio_variants() returns, turns
+    on fan-out: each file is read and decoded once and rendered once per variant,
+    saved with the label appended to the suffix (see RenderPipeline.render_many).
+    """
+
+    BACKENDS = ("thread", "process")
+
+    def __init__(self, file_paths, output_dir, settings, suffix="_processed", out_format="Auto",
+                 workers=None, backend="thread", tile_budget=None, memory_budget=None,
+                 readers=DEFAULT_IO_THREADS, writers=DEFAULT_IO_THREADS, queue_size=None, resume=True,
+                 tracer=None, memory_report=None, variants=None):
+        if backend not in self.BACKENDS:
+            raise ValueError(f"Unknown backend: {backend}")
+        self.file_paths = list(file_paths)
+        self.output_dir = output_dir
+        # Snapshot: the caller (e.g. the settings panel) may keep editing its object
+        self.settings = settings.snapshot()
+        if variants:
+            self.variants = [(label, variant.snapshot()) for label, variant in variants]
+        else:
+            self.variants = [(None, self.settings)]
+        self.suffix = suffix
+        self.out_format = out_format
+        self.workers = workers or os.cpu_count() or 4
+        self.backend = backend
+        self.readers = readers
+        self.writers = writers
+        self.queue_size = queue_size or self.workers
+        # tile_budget (bytes): render very large images in strips to bound memory
+        self.pipeline = RenderPipeline(tile_budget=tile_budget)
+        self.memory_budget = memory_budget or DEFAULT_MEMORY_BUDGET_MB * 1024 * 1024
+        # Each worker process fills its own caches; the thread backend shares this process's
+        cache_ceiling = (SHADOW_CACHE.max_bytes + TEXT_SPRITE_CACHE.max_bytes) * (self.workers if backend == "process" else 1)
+        self.cache_reserve = min(cache_ceiling, int(self.memory_budget * MAX_CACHE_RESERVE_FRACTION))
+        if cache_ceiling >= self.memory_budget:
+            print(f"Warning: the render caches of {self.workers} {backend} workers can hold up to "
+                  f"{cache_ceiling // (1024 * 1024)} MB, at least the whole memory budget of "
+                  f"{self.memory_budget // (1024 * 1024)} MB; reserving {self.cache_reserve // (1024 * 1024)} MB for them")
+        self.resume = resume
+        self.tracer = tracer
+        self.memory_report = memory_report
+        self.running = True
+        self.pools = None # (readers, compute, writers) kept warm between runs by open()
+        self.manifest = None # kept loaded between runs by open()
+
+    def open(self):
+        """Start the stage pools and load the manifest, and keep both across run()
+        calls (e.g. watch mode). The manifest, EXIF cache and memory report are then
+        saved by flush() when due and by close(), not after every run.
+
+        Without open(), each run() starts and shuts down its own pools.
+        """
+        if self.pools is None:
+            self.pools = self._create_pools()
+        if self.manifest is None:
+            self.manifest = BatchManifest(self.output_dir)
+
+    def close(self):
+        if self.pools is not None:
+            for pool in self.pools:
+                pool.shutdown(wait=True, cancel_futures=not self.running)
+            self.pools = None
+        if self.manifest is not None:
+            self._save_state(self.manifest)
+            self.manifest = None
+
+    def flush(self):
+        """Between runs of an open() session: save the manifest and EXIF cache if
+        their save interval has passed."""
+        if self.manifest is not None:
+            self.manifest.save_if_due()
+        EXIF_CACHE.save_if_due()
+
+    def _save_state(self, manifest: BatchManifest):
+        EXIF_CACHE.save()
+        manifest.save()
+        if self.memory_report is not None:
+            self._save_memory_report()
+
+    def _create_pools(self):
+        return (concurrent.futures.ThreadPoolExecutor(max_workers=self.readers),
+                self._create_executor(),
+                concurrent.futures.ThreadPoolExecutor(max_workers=self.writers))
+
+    def _create_executor(self):
+        if self.backend == "process":
+            # Workers are initialized once and then only receive file paths (and the parsed EXIF)
+            initargs = (self.output_dir, self.variants, self.suffix, self.out_format, self.pipeline.tile_budget)
+            return concurrent.futures.ProcessPoolExecutor(max_workers=self.workers,
+                                                          initializer=_init_worker, initargs=initargs)
+        return concurrent.futures.ThreadPoolExecutor(max_workers=self.workers)
+
+    def _submit_compute(self, executor, path, data, exif_data):
+        trace = self.tracer is not None
+        measure_memory = self.memory_report is not None
+        if self.backend == "process":
+            return executor.submit(_render_in_worker, path, exif_data, trace, measure_memory)
+        args = (path, data, self.output_dir, self.variants, self.suffix, self.out_format, self.pipeline, exif_data)
+        return executor.submit(_render_job, trace, measure_memory, *args)
+
+    def outputs_for(self, path: str) -> list:
+        """[(output path, settings digest)] of every variant of path."""
+        return [(build_output_path(path, self.output_dir, variant_suffix(self.suffix, label), self.out_format), settings.digest)
+                for label, settings in self.variants]
+
+    def _job_geometry(self, source_size: tuple) -> tuple:
+        """job_geometry over all variants: the largest target and its estimate, plus
+        room for one more shared foreground when fanning out. No file I/O: the size
+        comes from the header the reader threads already probed."""
+        geometries = [job_geometry(source_size, settings, self.pipeline) for _, settings in self.variants]
+        source_size, target_size, estimate = max(geometries, key=lambda g: g[2])
+        if len(geometries) > 1 and source_size:
+            estimate += source_size[0] * source_size[1] * 4
+        return source_size, target_size, estimate
+
+    def _submit_io(self, pool, name, path, func, *args):
+        if self.tracer is None:
+            return pool.submit(func, *args)
+        return pool.submit(_traced_io, self.tracer, name, path, func, *args)
+
+    def run(self, progress_callback=None, file_callback=None, file_paths=None) -> dict:
+        """Process all files. progress_callback(completed, total) is called after each file,
+        file_callback(path, error) after each processed file (error is None on success).
+        file_paths overrides the files given to the constructor.
+
+        Returns a summary dict with 'total', 'succeeded', 'skipped' (already up to date)
+        and 'failed' [(path, error)].
+        """
+        if file_paths is None:
+            file_paths = self.file_paths
+        total = len(file_paths)
+        completed = 0
+        summary = {'total': total, 'succeeded': 0, 'skipped': 0, 'failed': []}
+
+        if total == 0:
+            return summary
+
+        session = self.manifest is not None
+        manifest = self.manifest if session else BatchManifest(self.output_dir)
+        pending = collections.deque()
+        for path in file_paths:
+            # A file is skipped only if every variant is current; otherwise all are rendered again
+            if self.resume and all(manifest.is_current(path, digest, output_path)
+                                   for output_path, digest in self.outputs_for(path)):
+                summary['skipped'] += 1
+            else:
+                pending.append(path)
+        completed = summary['skipped']
+        if completed and progress_callback:
+            progress_callback(completed, total)
+
+        ready = collections.deque() # read, waiting for compute: (path, data, exif_data, cost, source)
+        # future -> (stage, path, cost, source); source = (content hash, stat) for the manifest
+        # and (source size, target size, estimate) for the memory report
+        stage_of = {}
+        counts = {'read': 0, 'compute': 0, 'write': 0}
+        compute_bytes = 0
+        # EXIF comes from the persistent header cache, read on the I/O threads
+        with_exif = any(settings.watermark.enabled for _, settings in self.variants)
+        # Process workers read the files themselves; the readers only hash them
+        keep_data = self.backend != "process"
+        if self.memory_report is not None:
+            self.memory_report.meta.update(backend=self.backend, workers=self.workers,
+                                           memory_budget=self.memory_budget, cache_reserve=self.cache_reserve)
+
+        owns_pools = self.pools is None
+        readers, executor, writers = self._create_pools() if owns_pools else self.pools
+        try:
+            while self.running and (pending or ready or stage_of):
+                # Prefetch while the read queue has room
+                while pending and counts['read'] + len(ready) < self.queue_size:
+                    path = pending.popleft()
+                    stage_of[self._submit_io(readers, "read", path, read_file, path, with_exif, keep_data)] = ('read', path, 0, None)
+                    counts['read'] += 1
+
+                # Start compute in order while workers are free, the memory budget allows
+                # and the write queue has room
+                while (ready and counts['compute'] < self.workers
+                       and counts['write'] < self.writers + self.queue_size):
+                    path, data, exif_data, cost, source = ready[0]
+                    if counts['compute'] and compute_bytes + cost > self.memory_budget - self.cache_reserve:
+                        break
+                    ready.popleft()
+                    stage_of[self._submit_compute(executor, path, data, exif_data)] = ('compute', path, cost, source)
+                    counts['compute'] += 1
+                    compute_bytes += cost
+
+                done, _ = concurrent.futures.wait(stage_of, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    stage, path, cost, source = stage_of.pop(future)
+                    counts[stage] -= 1
+                    if stage == 'compute':
+                        compute_bytes -= cost
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        print(f"Error processing {path}: {e}")
+                        summary['failed'].append((path, str(e)))
+                        if file_callback:
+                            file_callback(path, str(e))
+                    else:
+                        if stage == 'read':
+                            data, exif_data, digest, stat, source_size = result
+                            geometry = self._job_geometry(source_size)
+                            # The raw bytes are held in the compute stage either way
+                            cost = geometry[2] + stat.st_size
+                            ready.append((path, data, exif_data, cost, (digest, stat, geometry)))
+                            continue
+                        if stage == 'compute':
+                            outputs, timings, memory = result
+                            if timings:
+                                self.tracer.add(timings, file=path)
+                            if memory:
+                                ratio = "+".join(label for label, _ in self.variants) if len(self.variants) > 1 else None
+                                self.memory_report.add(path, *source[2], memory, ratio=ratio)
+                            stage_of[self._submit_io(writers, "write", path, write_outputs, outputs)] = ('write', path, 0, source)
+                            counts['write'] += 1
+                            continue
+                        summary['succeeded'] += 1
+                        digest, stat, _ = source
+                        for output_path, settings_digest in self.outputs_for(path):
+                            manifest.record(path, digest, settings_digest, output_path, stat)
+                        if file_callback:
+                            file_callback(path, None)
+
+                    completed += 1
+                    if progress_callback:
+                        progress_callback(completed, total)
+        except BaseException:
+            # e.g. KeyboardInterrupt from the CLI
+            self.running = False
+            raise
+        finally:
+            # Queued files are never started once stopped; running ones finish on their own
+            if owns_pools:
+                for pool in (readers, executor, writers):
+                    pool.shutdown(wait=True, cancel_futures=not self.running)
+            if session:
+                self.flush()
+            else:
+                self._save_state(manifest)
+
+        return summary
+
+    def _save_memory_report(self):
+        try:
+            self.memory_report.save(os.path.join(self.output_dir, MEMORY_REPORT_NAME))
+        except Exception as e:
+            print(f"Error saving memory report: {e}")
+
+    def stop(self):
+        self.running = False
@@ -0,0 +1,207 @@
+import os
+import threading
+from collections import OrderedDict
+from PIL import Image
+from .exif import read_exif
+
+DEFAULT_SOURCE_CACHE_MB = 1024
+DEFAULT_SHADOW_CACHE_MB = 64
+DEFAULT_TEXT_SPRITE_CACHE_MB = 32
+
+def image_nbytes(image: Image.Image) -> int:
+    """Approximate in-memory size of a decoded image."""
+    if image is None:
+        return 0
+    w, h = image.size
+    # PIL stores RGB as 4 bytes per pixel internally
+    bands = 4 if image.mode in ('RGB', 'RGBA', 'CMYK', 'YCbCr') else len(image.getbands())
+    return w * h * bands
+
+class SourceCache:
+    """Session-level LRU cache of decoded source images and their parsed EXIF.
+
+    Entries are keyed by (path, mtime, size) so an edited file is decoded again,
+    and evicted least-recently-used once max_bytes is exceeded.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_SOURCE_CACHE_MB * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.entries = OrderedDict() # key -> (image, exif_data, nbytes, scale)
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def make_key(path: str) -> tuple:
+        st = os.stat(path)
+        return (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+
+    def get(self, path: str) -> tuple:
+        """Return (image, exif_data) for path, decoding from disk only on a miss."""
+        image, exif_data, _ = self._get(path, None)
+        return image, exif_data
+
+    def get_proxy(self, path: str, max_size: tuple) -> tuple:
+        """Return (image, exif_data, scale) with the source reduced to fit max_size.
+
+        JPEGs are decoded directly at reduced size (draft mode), so the full-resolution
+        pixels are never materialized. scale is proxy width / original width.
+        """
+        return self._get(path, tuple(max_size))
+
+    def _get(self, path: str, max_size: tuple) -> tuple:
+        try:
+            key = self.make_key(path) + (max_size,)
+        except OSError as e:
+            print(f"Error loading image {path}: {e}")
+            return None, {}, 1.0
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry:
+                self.entries.move_to_end(key)
+                return entry[0], entry[1], entry[3]
+
+        # Decode outside the lock so other readers are not blocked
+        try:
+            image, scale = self._decode(path, max_size)
+        except Exception as e:
+            print(f"Error loading image {path}: {e}")
+            return None, {}, 1.0
+        # Straight from the file header; a proxy decode may not carry the EXIF blob
+        exif_data = read_exif(path)
+
+        nbytes = image_nbytes(image)
+        with self.lock:
+            if key not in self.entries:
+                self.entries[key] = (image, exif_data, nbytes, scale)
+                self.current_bytes += nbytes
+            self.entries.move_to_end(key)
+            self._evict()
+        return image, exif_data, scale
+
+    def _decode(self, path: str, max_size: tuple) -> tuple:
+        image = Image.open(path)
+        full_w, full_h = image.size
+        if max_size:
+            scale = min(1.0, max_size[0] / full_w, max_size[1] / full_h)
+            if scale < 1.0:
+                size = (max(1, int(full_w * scale)), max(1, int(full_h * scale)))
+                # Let the JPEG decoder do most of the reduction (1/2, 1/4, 1/8)
+                image.draft(image.mode, size)
+                image.load()
+                info = image.info
+                if image.size != size:
+                    image = image.resize(size, Image.Resampling.LANCZOS)
+                    image.info = info
+        image.load()
+        return image, image.width / full_w
+
+    def _evict(self):
+        # Always keep the most recent entry, even if it alone exceeds the ceiling
+        while self.current_bytes > self.max_bytes and len(self.entries) > 1:
+            _, (_, _, nbytes, _) = self.entries.popitem(last=False)
+            self.current_bytes -= nbytes
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.current_bytes = 0
+
+class StageCache:
+    """Memoizes intermediate render stages (background, foreground, shadow, base canvas)
+    for the current source image.
+
+    Keys are built by ImageProcessor from only the settings each stage depends on,
+    so e.g. a watermark edit reuses every cached stage and a blur edit keeps the
+    resized foreground. Binding a different source image clears the cache.
+    """
+
+    def __init__(self, max_entries_per_stage: int = 1, stages: tuple = None):
+        self.max_entries_per_stage = max_entries_per_stage
+        self.only = stages # cache only these stages (None: all)
+        self.source = None
+        self.stages = {} # stage -> OrderedDict(key -> value)
+        self.lock = threading.Lock()
+
+    def bind(self, image: Image.Image):
+        with self.lock:
+            if image is not self.source:
+                self.stages.clear()
+                self.source = image
+
+    def caches(self, stage: str) -> bool:
+        return self.only is None or stage in self.only
+
+    def get(self, stage: str, key):
+        with self.lock:
+            entries = self.stages.get(stage)
+            if entries is None or key not in entries:
+                return None
+            entries.move_to_end(key)
+            return entries[key]
+
+    def put(self, stage: str, key, value):
+        if self.only is not None and stage not in self.only:
+            return
+        with self.lock:
+            entries = self.stages.setdefault(stage, OrderedDict())
+            entries[key] = value
+            entries.move_to_end(key)
+            while len(entries) > self.max_entries_per_stage:
+                entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.stages.clear()
+            self.source = None
+
+def _first_image_nbytes(value: tuple) -> int:
+    return image_nbytes(value[0])
+
+class BoundedCache:
+    """Thread-safe LRU shared process-wide, evicted once max_bytes is exceeded.
+
+    sizeof(value) gives each entry's size; by default values are tuples whose
+    first item is an image.
+    """
+
+    def __init__(self, max_bytes: int, sizeof=_first_image_nbytes):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.current_bytes = 0
+        self.entries = OrderedDict() # key -> (value, nbytes)
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value):
+        nbytes = self.sizeof(value)
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old[1]
+            self.entries[key] = (value, nbytes)
+            self.current_bytes += nbytes
+            # Always keep the most recent entry, even if it alone exceeds the ceiling
+            while self.current_bytes > self.max_bytes and len(self.entries) > 1:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.current_bytes -= evicted
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.current_bytes = 0
+
+# Reduced-resolution shadow masks (mask, box), keyed by (width, height, corner_radius,
+# shadow_size, rounded): a batch of same-size images renders the shadow once.
+# Small shadows are not downscaled, so masks can be large.
+SHADOW_CACHE = BoundedCache(DEFAULT_SHADOW_CACHE_MB * 1024 * 1024)
+# Watermark text sprites (sprite, origin, width, height), keyed by (text, font, size,
+# color, opacity): a shoot from one camera draws its text once.
+TEXT_SPRITE_CACHE = BoundedCache(DEFAULT_TEXT_SPRITE_CACHE_MB * 1024 * 1024)
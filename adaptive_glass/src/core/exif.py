@@ -0,0 +1,244 @@
+import json
+import os
+import struct
+import threading
+import time
+from PIL import Image
+
+DEFAULT_EXIF_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".adaptive_glass", "exif_cache.json")
+DEFAULT_EXIF_CACHE_ENTRIES = 20000
+
+# TIFF tags the watermark uses
+TAG_MAKE = 0x010F
+TAG_MODEL = 0x0110
+TAG_EXIF_IFD = 0x8769
+TAG_EXPOSURE_TIME = 0x829A
+TAG_FNUMBER = 0x829D
+TAG_ISO = 0x8827
+TAG_FOCAL_LENGTH = 0x920A
+
+# TIFF type -> (struct code, size)
+TIFF_TYPES = {1: ('B', 1), 2: ('s', 1), 3: ('H', 2), 4: ('L', 4), 5: ('LL', 8),
+              7: ('B', 1), 9: ('l', 4), 10: ('ll', 8)}
+
+def _find_tiff_jpeg(f) -> bytes:
+    """Return the TIFF block of the JPEG APP1 Exif segment, reading only the headers."""
+    if f.read(2) != b'\xff\xd8':
+        raise ValueError("Not a JPEG")
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            raise ValueError("Corrupt JPEG header")
+        if marker[1] in (0xD9, 0xDA): # EOI / start of scan: no EXIF
+            return b''
+        length = struct.unpack('>H', f.read(2))[0]
+        if marker[1] == 0xE1:
+            data = f.read(length - 2)
+            if data.startswith(b'Exif\x00\x00'):
+                return data[6:]
+        else:
+            f.seek(length - 2, os.SEEK_CUR)
+
+def _find_tiff_png(f) -> bytes:
+    """Return the TIFF block of the PNG eXIf chunk, reading only chunks before the pixel data."""
+    if f.read(8) != b'\x89PNG\r\n\x1a\n':
+        raise ValueError("Not a PNG")
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            return b''
+        length, chunk_type = struct.unpack('>I4s', header)
+        if chunk_type in (b'IDAT', b'IEND'):
+            return b''
+        if chunk_type == b'eXIf':
+            data = f.read(length)
+            return data[6:] if data.startswith(b'Exif\x00\x00') else data
+        f.seek(length + 4, os.SEEK_CUR) # data + CRC
+
+def _read_ifd(tiff: bytes, offset: int, order: str, wanted: tuple) -> dict:
+    """Read the wanted tags of one IFD as raw values."""
+    values = {}
+    count = struct.unpack_from(order + 'H', tiff, offset)[0]
+    for i in range(count):
+        tag, typ, n, raw = struct.unpack_from(order + 'HHI4s', tiff, offset + 2 + i * 12)
+        if tag not in wanted or typ not in TIFF_TYPES:
+            continue
+        code, size = TIFF_TYPES[typ]
+        data_offset = offset + 10 + i * 12
+        if size * n > 4:
+            data_offset = struct.unpack(order + 'I', raw)[0]
+        if typ == 2:
+            # Drop the terminating NUL, like piexif
+            values[tag] = tiff[data_offset:data_offset + max(0, n - 1)]
+            continue
+        items = struct.unpack_from(order + code * n, tiff, data_offset)
+        if typ in (5, 10):
+            items = tuple(zip(items[::2], items[1::2])) # (numerator, denominator) pairs
+        values[tag] = items[0] if n == 1 else items
+    return values
+
+def _decode_ascii(val: bytes) -> str:
+    try:
+        return val.decode('utf-8').strip('\x00')
+    except UnicodeDecodeError:
+        return str(val)
+
+def _format_rational(val, exposure: bool = False) -> str:
+    """Same formatting as WatermarkEngine.get_exif_data."""
+    if not (isinstance(val, tuple) and len(val) == 2):
+        return str(val)
+    num, den = val
+    if exposure:
+        if den == 0: return "0"
+        if num >= den: return str(num / den)
+        return f"{num}/{den}"
+    if den == 0:
+        return str(num)
+    return str(round(num / den, 1))
+
+def parse_tiff(tiff: bytes) -> dict:
+    """Extract Make, Model, ISO, FNumber, ExposureTime and FocalLength from a TIFF/EXIF block."""
+    exif_data = {}
+    if not tiff:
+        return exif_data
+
+    order = {b'II': '<', b'MM': '>'}.get(tiff[:2])
+    if order is None or struct.unpack_from(order + 'H', tiff, 2)[0] != 42:
+        raise ValueError("Invalid TIFF header")
+
+    ifd0 = _read_ifd(tiff, struct.unpack_from(order + 'I', tiff, 4)[0], order, (TAG_MAKE, TAG_MODEL, TAG_EXIF_IFD))
+    for tag, name in ((TAG_MAKE, 'Make'), (TAG_MODEL, 'Model')):
+        if tag in ifd0:
+            exif_data[name] = _decode_ascii(ifd0[tag])
+
+    if TAG_EXIF_IFD in ifd0:
+        wanted = (TAG_ISO, TAG_EXPOSURE_TIME, TAG_FNUMBER, TAG_FOCAL_LENGTH)
+        photo = _read_ifd(tiff, ifd0[TAG_EXIF_IFD], order, wanted)
+        if TAG_ISO in photo:
+            exif_data['ISOSpeedRatings'] = photo[TAG_ISO]
+        if TAG_EXPOSURE_TIME in photo:
+            exif_data['ExposureTime'] = _format_rational(photo[TAG_EXPOSURE_TIME], exposure=True)
+        if TAG_FNUMBER in photo:
+            exif_data['FNumber'] = _format_rational(photo[TAG_FNUMBER])
+        if TAG_FOCAL_LENGTH in photo:
+            exif_data['FocalLength'] = _format_rational(photo[TAG_FOCAL_LENGTH])
+    return exif_data
+
+def read_exif(path: str) -> dict:
+    """Read the watermark's EXIF fields straight from the file header, without decoding pixels.
+
+    Falls back to PIL + piexif for other containers or malformed headers.
+    """
+    try:
+        with open(path, 'rb') as f:
+            magic = f.read(8)
+            f.seek(0)
+            if magic.startswith(b'\xff\xd8'):
+                return parse_tiff(_find_tiff_jpeg(f))
+            if magic.startswith(b'\x89PNG'):
+                return parse_tiff(_find_tiff_png(f))
+            if magic.startswith(b'BM'):
+                return {} # BMP has no EXIF
+    except (ValueError, struct.error) as e:
+        print(f"Error reading EXIF header of {path}: {e}")
+    except OSError as e:
+        print(f"Error reading EXIF header of {path}: {e}")
+        return {}
+
+    # Imported here: watermark -> fonts -> cache -> exif would otherwise be circular
+    from .watermark import WatermarkEngine
+    try:
+        with Image.open(path) as image:
+            return WatermarkEngine().get_exif_data(image)
+    except Exception as e:
+        print(f"Error extracting EXIF from {path}: {e}")
+        return {}
+
+class ExifCache:
+    """Persistent EXIF cache (JSON on disk) keyed by path + mtime + size.
+
+    Repeat batches over the same folders skip EXIF parsing entirely. Call save()
+    once a batch is done (or save_if_due() from long-running sessions); entries are
+    written atomically. Once there are more than max_entries, saving drops entries
+    of files that no longer exist, then the least recently used ones.
+    """
+
+    SAVE_INTERVAL = 60.0 # seconds, for save_if_due()
+
+    def __init__(self, cache_path: str = DEFAULT_EXIF_CACHE_PATH, max_entries: int = DEFAULT_EXIF_CACHE_ENTRIES):
+        self.cache_path = cache_path
+        self.max_entries = max_entries
+        self.entries = None # abspath -> [mtime_ns, size, exif_data]; loaded lazily
+        self.dirty = False
+        self.last_save = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _load(self):
+        self.entries = {}
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Error loading EXIF cache: {e}")
+
+    def get(self, path: str) -> dict:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return {}
+        key = os.path.abspath(path)
+
+        with self.lock:
+            if self.entries is None:
+                self._load()
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                # Re-insert to keep the dict in least-recently-used order
+                self.entries[key] = entry
+        if entry and entry[0] == st.st_mtime_ns and entry[1] == st.st_size:
+            exif_data = dict(entry[2])
+            # JSON has no tuples (multi-value ISO)
+            if isinstance(exif_data.get('ISOSpeedRatings'), list):
+                exif_data['ISOSpeedRatings'] = tuple(exif_data['ISOSpeedRatings'])
+            return exif_data
+
+        exif_data = read_exif(path)
+        with self.lock:
+            self.entries[key] = [st.st_mtime_ns, st.st_size, exif_data]
+            self.dirty = True
+        return exif_data
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            self.last_save = time.monotonic()
+            if len(self.entries) > self.max_entries:
+                self._prune()
+            try:
+                os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+                tmp_path = self.cache_path + ".tmp"
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(self.entries, f, ensure_ascii=False)
+                os.replace(tmp_path, self.cache_path)
+                self.dirty = False
+            except Exception as e:
+                print(f"Error saving EXIF cache: {e}")
+
+    def save_if_due(self):
+        """save() if SAVE_INTERVAL has passed since the last one."""
+        if time.monotonic() - self.last_save > self.SAVE_INTERVAL:
+            self.save()
+
+    def _prune(self):
+        for key in [key for key in self.entries if not os.path.exists(key)]:
+            del self.entries[key]
+        # Trim to 90% so the next few saves do not have to prune (and stat every file) again
+        excess = len(self.entries) - self.max_entries * 9 // 10
+        if excess > 0:
+            for key in list(self.entries)[:excess]:
+                del self.entries[key]
+
+EXIF_CACHE = ExifCache()
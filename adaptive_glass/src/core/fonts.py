@@ -0,0 +1,72 @@
+import os
+import threading
+from collections import OrderedDict
+from PIL import ImageFont
+
+# Used when the text contains CJK characters and the chosen font has no such glyphs
+CJK_FALLBACK_FONTS = ("C:\\Windows\\Fonts\\msyh.ttc", "C:\\Windows\\Fonts\\simhei.ttf")
+
+class FontCache:
+    """Thread-safe LRU of loaded FreeType fonts, keyed by (resolved path, size).
+
+    Also memoizes font path resolution (custom font, default font, CJK fallback)
+    so batches don't hit the filesystem per image. Shared by every WatermarkEngine
+    in the process; each process-pool worker keeps its own warm copy.
+    """
+
+    def __init__(self, max_entries: int = 32):
+        self.max_entries = max_entries
+        self.fonts = OrderedDict() # (path, size) -> FreeTypeFont, or None if it failed to load
+        self.paths = {} # (font_path, default_path, cjk) -> resolved path
+        self.lock = threading.Lock()
+
+    def resolve(self, font_path: str, default_path: str, cjk: bool = False) -> str:
+        """Return the font file to use for the watermark text."""
+        key = (font_path, default_path, cjk)
+        with self.lock:
+            if key in self.paths:
+                return self.paths[key]
+
+        path = default_path
+        if font_path and os.path.exists(font_path):
+            path = font_path
+
+        # Chinese Font Fallback
+        if cjk and ("SMILETSANS" in path.upper() or "ARIAL" in path.upper()):
+            if os.name == 'nt':
+                for fallback in CJK_FALLBACK_FONTS:
+                    if os.path.exists(fallback):
+                        path = fallback
+                        break
+
+        with self.lock:
+            self.paths[key] = path
+        return path
+
+    def get(self, path: str, size: int):
+        """Return the loaded font, or None if the file cannot be opened."""
+        key = (path, size)
+        with self.lock:
+            if key in self.fonts:
+                self.fonts.move_to_end(key)
+                return self.fonts[key]
+
+        # Load outside the lock; a concurrent miss just loads the same font twice
+        try:
+            font = ImageFont.truetype(path, size)
+        except IOError:
+            font = None
+
+        with self.lock:
+            self.fonts[key] = font
+            self.fonts.move_to_end(key)
+            while len(self.fonts) > self.max_entries:
+                self.fonts.popitem(last=False)
+        return font
+
+    def clear(self):
+        with self.lock:
+            self.fonts.clear()
+            self.paths.clear()
+
+FONT_CACHE = FontCache()
@@ -0,0 +1,105 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+MANIFEST_NAME = ".adaptive_glass_manifest.json"
+MANIFEST_VERSION = 2 # settings hashes are SettingsSnapshot.digest
+
+def content_hash(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+def content_hash_file(f, chunk_size: int = 1024 * 1024) -> str:
+    """content_hash of an open binary file, read in chunks."""
+    h = hashlib.blake2b(digest_size=16)
+    for chunk in iter(lambda: f.read(chunk_size), b''):
+        h.update(chunk)
+    return h.hexdigest()
+
+class BatchManifest:
+    """Record of finished batch outputs, stored in the output directory.
+
+    Each output (absolute path) maps to its source path and the source's size, mtime
+    and content hash, plus the settings digest (SettingsSnapshot.digest) it was
+    rendered with. A rerun skips
+    sources whose output is still current, so a stopped or crashed batch resumes
+    where it left off and a folder with a few new files only processes those.
+    """
+
+    SAVE_INTERVAL = 5.0 # seconds between intermediate saves during a run
+
+    def __init__(self, output_dir: str):
+        self.path = os.path.join(output_dir, MANIFEST_NAME)
+        self.entries = {}
+        self.dirty = False
+        self.last_save = time.monotonic()
+        self.lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == MANIFEST_VERSION:
+                self.entries = data.get('files', {})
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Error loading batch manifest: {e}")
+
+    def is_current(self, path: str, settings_digest: str, output_path: str) -> bool:
+        """True if output_path is an up-to-date render of path with these settings."""
+        entry = self.entries.get(os.path.abspath(output_path))
+        if not entry or entry['settings_hash'] != settings_digest or entry['source'] != os.path.abspath(path):
+            return False
+        if not os.path.exists(output_path):
+            return False
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+        if st.st_size != entry['size']:
+            return False
+        if st.st_mtime_ns == entry['mtime_ns']:
+            return True
+
+        # Touched but maybe not changed: compare content
+        with open(path, 'rb') as f:
+            if content_hash(f.read()) != entry['content_hash']:
+                return False
+        with self.lock:
+            entry['mtime_ns'] = st.st_mtime_ns
+            self.dirty = True
+        return True
+
+    def record(self, path: str, digest: str, settings_digest: str, output_path: str, stat: os.stat_result):
+        with self.lock:
+            self.entries[os.path.abspath(output_path)] = {
+                'source': os.path.abspath(path),
+                'size': stat.st_size,
+                'mtime_ns': stat.st_mtime_ns,
+                'content_hash': digest,
+                'settings_hash': settings_digest
+            }
+            self.dirty = True
+        self.save_if_due()
+
+    def save_if_due(self):
+        """save() if SAVE_INTERVAL has passed since the last one."""
+        if time.monotonic() - self.last_save > self.SAVE_INTERVAL:
+            self.save()
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            try:
+                tmp_path = self.path + ".tmp"
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump({'version': MANIFEST_VERSION, 'files': self.entries}, f, ensure_ascii=False)
+                os.replace(tmp_path, self.path)
+                self.dirty = False
+            except Exception as e:
+                print(f"Error saving batch manifest: {e}")
+            self.last_save = time.monotonic()
@@ -0,0 +1,184 @@
+import json
+import os
+import sys
+import threading
+import tracemalloc
+from enum import Enum
+from dataclasses import asdict
+
+MEMORY_REPORT_NAME = "adaptive_glass_memory.json"
+WORST_COUNT = 10
+
+def _windows_rss():
+    import ctypes
+    from ctypes import wintypes
+
+    class ProcessMemoryCounters(ctypes.Structure):
+        _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                    ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                    ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                    ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                    ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+
+    kernel32 = ctypes.windll.kernel32
+    kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+    counters = ProcessMemoryCounters()
+    counters.cb = ctypes.sizeof(counters)
+    if not kernel32.K32GetProcessMemoryInfo(kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb):
+        return None
+    return counters.WorkingSetSize
+
+def rss_bytes():
+    """Resident set size of this process in bytes, or None where it is not available."""
+    try:
+        if sys.platform.startswith("linux"):
+            with open("/proc/self/statm", "rb") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        if os.name == "nt":
+            return _windows_rss()
+    except (OSError, ValueError, AttributeError):
+        pass
+    return None
+
+class MemoryProbe:
+    """Context manager measuring the memory of one job.
+
+    traced_peak is the tracemalloc peak (Python objects; Pillow's pixel buffers are
+    not traced), rss_peak the highest RSS above the start, sampled on a background
+    thread, and rss_delta what the job left behind (caches, leaks). Both are
+    process-wide, so they are exact per image only while one image renders per
+    process (process backend, or a single worker). The tracemalloc peak can only be
+    reset for the whole process, so a probe that overlapped another one reports
+    traced_peak as None and traced_shared as True.
+
+    tracemalloc is started by the first active probe and stopped again when the
+    last one exits (unless something else had started it), so it costs nothing
+    between measured jobs.
+    """
+
+    SAMPLE_INTERVAL = 0.01 # seconds
+
+    _lock = threading.Lock()
+    _active = set() # probes currently measuring
+    _started_tracing = False # whether the probes started tracemalloc
+
+    def __enter__(self):
+        cls = MemoryProbe
+        with cls._lock:
+            if not cls._active:
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start()
+                    cls._started_tracing = True
+                tracemalloc.reset_peak()
+                self.shared = False
+            else:
+                self.shared = True
+                for probe in cls._active:
+                    probe.shared = True
+            cls._active.add(self)
+            self.traced_start = tracemalloc.get_traced_memory()[0]
+        self.rss_start = rss_bytes()
+        self.rss_max = self.rss_start
+        self.stopped = threading.Event()
+        self.sampler = None
+        if self.rss_start is not None:
+            self.sampler = threading.Thread(target=self._sample, daemon=True)
+            self.sampler.start()
+        self.result = {}
+        return self
+
+    def _sample(self):
+        while not self.stopped.wait(self.SAMPLE_INTERVAL):
+            rss = rss_bytes()
+            if rss is not None and rss > self.rss_max:
+                self.rss_max = rss
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        if self.sampler is not None:
+            self.sampler.join()
+        cls = MemoryProbe
+        with cls._lock:
+            traced_peak = None if self.shared else max(0, tracemalloc.get_traced_memory()[1] - self.traced_start)
+            cls._active.discard(self)
+            if not cls._active and cls._started_tracing:
+                tracemalloc.stop()
+                cls._started_tracing = False
+        rss_end = rss_bytes()
+        self.result = {'traced_peak': traced_peak, 'traced_shared': self.shared, 'rss_peak': None, 'rss_delta': None,
+                       'pid': os.getpid()}
+        if self.rss_start is not None and rss_end is not None:
+            self.result['rss_peak'] = max(self.rss_max, rss_end) - self.rss_start
+            self.result['rss_delta'] = rss_end - self.rss_start
+        return False
+
+def _mb(value) -> str:
+    return "-" if value is None else f"{value / (1024 * 1024):.1f} MB"
+
+class MemoryReport:
+    """Per-image memory records of a batch run, for sizing worker counts and memory budgets.
+
+    Each record holds the file, its source and target size, the ratio, the memory
+    estimate the scheduler used and the MemoryProbe measurements. save() writes
+    the records, the settings and the worst offenders as JSON.
+    """
+
+    def __init__(self, settings=None):
+        self.settings = settings
+        self.meta = {}
+        self.records = []
+        self.lock = threading.Lock()
+
+    def add(self, path: str, source_size: tuple, target_size: tuple, estimate: int, stats: dict, ratio: str = None):
+        """ratio overrides the settings' ratio name (e.g. the labels of a fan-out)."""
+        record = {
+            'file': path,
+            'source_size': list(source_size) if source_size else None,
+            'megapixels': round(source_size[0] * source_size[1] / 1e6, 1) if source_size else None,
+            'aspect': round(source_size[0] / source_size[1], 2) if source_size else None,
+            'target_size': list(target_size) if target_size else None,
+            'ratio': ratio or (self.settings.target_ratio.name if self.settings else None),
+            'estimate': estimate
+        }
+        record.update(stats)
+        with self.lock:
+            self.records.append(record)
+
+    @staticmethod
+    def peak(record: dict) -> int:
+        """Measured peak of a record: sampled RSS where available, else traced memory."""
+        if record.get('rss_peak') is not None:
+            return record['rss_peak']
+        return record.get('traced_peak') or 0
+
+    def worst(self, count: int = WORST_COUNT) -> list:
+        with self.lock:
+            records = list(self.records)
+        return sorted(records, key=self.peak, reverse=True)[:count]
+
+    def summary(self, count: int = WORST_COUNT) -> str:
+        """Human-readable list of the worst offenders."""
+        worst = self.worst(count)
+        if not worst:
+            return "没有内存记录"
+        lines = [f"内存占用最高的 {len(worst)} 张图片 (峰值 RSS 增长 / Python 分配峰值 / 预估):"]
+        for i, r in enumerate(worst, 1):
+            src = "x".join(map(str, r['source_size'])) if r['source_size'] else "?"
+            dst = "x".join(map(str, r['target_size'])) if r['target_size'] else "?"
+            lines.append(f"{i:>3}. {os.path.basename(r['file'])}  {src} -> {r['ratio']} {dst}  "
+                         f"{_mb(r['rss_peak'])} / {_mb(r['traced_peak'])} / {_mb(r['estimate'])}")
+        if self.meta.get('backend') == "thread" and self.meta.get('workers', 1) > 1:
+            lines.append("注意: 多线程并行时各图片的 RSS 会相互叠加，与其他图片同时处理的图片不记录 Python 分配峰值 (-)，"
+                         "逐张准确统计请使用多进程或单线程")
+        return "\n".join(lines)
+
+    def save(self, path: str):
+        settings = None
+        if self.settings is not None:
+            settings = json.loads(json.dumps(asdict(self.settings), ensure_ascii=False,
+                                             default=lambda v: v.name if isinstance(v, Enum) else str(v)))
+        with self.lock:
+            records = list(self.records)
+        data = {'meta': self.meta, 'settings': settings, 'worst': self.worst(), 'records': records}
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
@@ -0,0 +1,270 @@
+from dataclasses import dataclass, replace
+from PIL import Image
+from .utils import ProcessingSettings, scale_settings
+from .processor import ImageProcessor
+from .cache import StageCache, image_nbytes
+from .watermark import WatermarkEngine
+from .profiling import StageProfiler
+
+# Worth sharing between the renders of one fan-out (see RenderPipeline.render_many)
+FANOUT_SHARED_STAGES = ("foreground",)
+# Below this fill scale, the background's downscale of the source is shared by the fan-out
+FANOUT_BACKGROUND_MAX_SCALE = 0.5
+
+class RenderCancelled(Exception):
+    """Raised between stages when the render's cancel check returns True."""
+
+@dataclass
+class Layout:
+    """Layout contract shared by every stage: canvas size and foreground rect."""
+    target_size: tuple
+    content_rect: tuple # (x, y, w, h)
+    content_scale: int = 100
+    render_scale: float = 1.0 # < 1.0 for proxy renders
+
+    def to_dict(self) -> dict:
+        return {
+            'target_size': self.target_size,
+            'content_rect': self.content_rect,
+            'content_scale': self.content_scale,
+            'render_scale': self.render_scale
+        }
+
+class RenderContext:
+    """State handed from stage to stage during one render."""
+
+    def __init__(self, image: Image.Image, settings: ProcessingSettings, exif_data: dict = None, skip=(), render_scale: float = 1.0):
+        self.image = image
+        self.background_source = image
+        self.render_scale = render_scale
+        # Frozen, so nothing can change under a running render; pixel-sized settings
+        # follow the render resolution
+        self.settings = scale_settings(settings.snapshot(), render_scale)
+        self.exif_data = exif_data
+        self.skipped = set(skip)
+        self.tiled = False
+        self.layout = None
+        self.keys = {} # stage -> cache key
+        self.background = None
+        self.foreground = None
+        self.shadow = None # (shadow_layer, padding)
+        self.canvas = None
+        self.overlay_watermark = False
+        self.watermark = None # (sprite, position, origin) when overlay_watermark is set
+        self.reused = set() # ids of images taken from the stage cache (not allocated by this render)
+
+    def images(self) -> list:
+        """Images currently held by the context."""
+        shadow = self.shadow[0] if self.shadow else None
+        sprite = self.watermark[0] if self.watermark else None
+        return [i for i in (self.background, self.foreground, shadow, self.canvas, sprite) if i is not None]
+
+class RenderPipeline:
+    """Single render path used by the editor, batch and the verify scripts.
+
+    Stages run in declared order, each exactly once per render. Optional stages can
+    be skipped per call, and extra stages can be inserted with add_stage().
+
+    With tile_budget (bytes) set, renders whose full-frame intermediates would exceed
+    the budget build the base canvas in horizontal strips instead (see
+    ImageProcessor.render_tiled).
+    """
+
+    STAGES = ("layout", "background", "foreground", "shadow", "composite", "watermark")
+    OPTIONAL_STAGES = ("shadow", "watermark")
+
+    def __init__(self, processor: ImageProcessor = None, watermarker: WatermarkEngine = None, tile_budget: int = None):
+        self.processor = processor or ImageProcessor()
+        self.watermarker = watermarker or WatermarkEngine()
+        self.tile_budget = tile_budget
+        self.stages = [(name, getattr(self, f"_stage_{name}")) for name in self.STAGES]
+
+    def add_stage(self, name: str, func, after: str = "watermark"):
+        """Insert func(ctx) after an existing stage. The stage may replace ctx.canvas."""
+        names = [n for n, _ in self.stages]
+        if name in names:
+            raise ValueError(f"Stage already exists: {name}")
+        self.stages.insert(names.index(after) + 1, (name, func))
+
+    def render(self, image: Image.Image, settings: ProcessingSettings, exif_data: dict = None, skip=(),
+               render_scale: float = 1.0, cancel=None, overlay_watermark: bool = False,
+               profiler: StageProfiler = None, background_source: Image.Image = None) -> tuple[Image.Image, dict]:
+        """Render image with settings. Returns (image, layout_info).
+
+        For a proxy render, pass the downscaled source and its scale relative to the
+        original; radii, border widths and font sizes are scaled to match the export.
+        cancel is an optional callable checked before every stage; when it returns
+        True the render stops with RenderCancelled.
+        With overlay_watermark the watermark is not drawn onto the canvas; it is returned
+        as layout_info['watermark'] = (sprite, position, origin) (None if nothing to draw)
+        for the caller to composite itself.
+        With a profiler, every stage's wall time, CPU time and newly allocated image
+        bytes are recorded and returned as layout_info['timings'].
+        background_source, a downscaled copy of image, replaces it as the input of
+        the background stage.
+        """
+        if not image:
+            return None, {}
+
+        for name in skip:
+            if name not in self.OPTIONAL_STAGES:
+                raise ValueError(f"Stage cannot be skipped: {name}")
+
+        ctx = RenderContext(image, settings, exif_data, skip, render_scale)
+        ctx.overlay_watermark = overlay_watermark
+        if background_source is not None:
+            ctx.background_source = background_source
+        for name, func in self.stages:
+            if name in ctx.skipped:
+                continue
+            if cancel is not None and cancel():
+                raise RenderCancelled(name)
+            if profiler is None:
+                func(ctx)
+                continue
+            with profiler.stage(name) as entry:
+                before = {id(i) for i in ctx.images()}
+                func(ctx)
+                entry['bytes'] = sum(image_nbytes(i) for i in ctx.images()
+                                     if id(i) not in before and id(i) not in ctx.reused)
+
+        layout_info = ctx.layout.to_dict()
+        if overlay_watermark:
+            layout_info['watermark'] = ctx.watermark
+        if profiler is not None:
+            layout_info['timings'] = profiler.timings
+        return ctx.canvas, layout_info
+
+    def render_many(self, image: Image.Image, settings_list: list, exif_data: dict = None, skip=(),
+                    profiler: StageProfiler = None):
+        """Fan-out: render image once per settings (e.g. one per target ratio) in a single pass.
+
+        Yields (image, layout_info) for each settings in order, so the caller can
+        encode and drop each canvas before the next is built. Work is shared across
+        the renders: the source is decoded and its EXIF parsed once, the background
+        stage of every render starts from one downscaled copy of the source (each
+        still blurs its own crop), and renders whose foreground has the same size
+        and border reuse the resized foreground.
+        """
+        if not image:
+            return
+        settings_list = [settings.snapshot() for settings in settings_list]
+        if len(settings_list) == 1:
+            yield self.render(image, settings_list[0], exif_data, skip, profiler=profiler)
+            return
+
+        image.load()
+        if exif_data is None and any(s.watermark.enabled for s in settings_list):
+            exif_data = self.watermarker.get_exif_data(image)
+        background_source = self._background_source(image, settings_list)
+
+        # Private cache: shared foregrounds only (full-size backgrounds and canvases
+        # differ per ratio), two at a time to bound memory
+        processor = ImageProcessor(StageCache(2, FANOUT_SHARED_STAGES))
+        pipeline = RenderPipeline(processor, self.watermarker, self.tile_budget)
+        # Same stages (including added ones), the built-in ones bound to the fan-out pipeline
+        pipeline.stages = [(name, getattr(pipeline, f"_stage_{name}") if name in self.STAGES else func)
+                           for name, func in self.stages]
+        for settings in settings_list:
+            yield pipeline.render(image, settings, exif_data, skip, profiler=profiler,
+                                  background_source=background_source)
+
+    def _background_source(self, image: Image.Image, settings_list: list) -> Image.Image:
+        """One downscaled copy of image at the largest background fill scale of the
+        fan-out, or None when that would not be much smaller than the source."""
+        processor = self.processor
+        scale = max(processor._background_fill_scale(image.size, *processor._calculate_target_size(image.size, s.target_ratio))
+                    for s in settings_list)
+        if scale > FANOUT_BACKGROUND_MAX_SCALE:
+            return None
+        img_w, img_h = image.size
+        # Same rounding as the background stage, so the largest render needs no further resize
+        size = (max(1, int(img_w * scale)), max(1, int(img_h * scale)))
+        return image.resize(size, Image.Resampling.BILINEAR)
+
+    def _stage_layout(self, ctx: RenderContext):
+        processor = self.processor
+        settings = ctx.settings
+        if processor.stage_cache is not None:
+            processor.stage_cache.bind(ctx.image)
+
+        target_w, target_h = processor._calculate_target_size(ctx.image.size, settings.target_ratio)
+        x, y, new_w, new_h = processor._calculate_content_rect(ctx.image.size, target_w, target_h, settings)
+        ctx.layout = Layout((target_w, target_h), (x, y, new_w, new_h), settings.content_scale, ctx.render_scale)
+
+        ctx.keys['background'] = processor._background_key(target_w, target_h, settings)
+        ctx.keys['foreground'] = processor._foreground_key(new_w, new_h, settings)
+        ctx.keys['shadow'] = None if 'shadow' in ctx.skipped else processor._shadow_key(new_w, new_h, settings)
+        ctx.keys['composite'] = (ctx.keys['background'], ctx.keys['foreground'], ctx.keys['shadow'])
+
+        if self.tile_budget is not None:
+            estimate = processor.estimate_render_bytes(ctx.image.size, ctx.layout.target_size, ctx.layout.content_rect)
+            ctx.tiled = estimate > self.tile_budget
+
+        # A cached base canvas makes background/foreground/shadow unnecessary
+        if processor.stage_cache is not None and not ctx.tiled:
+            ctx.canvas = processor.stage_cache.get('base', ctx.keys['composite'])
+            if ctx.canvas is not None:
+                ctx.reused.add(id(ctx.canvas))
+
+    def _cached(self, ctx: RenderContext, stage: str, key: tuple, build):
+        """ImageProcessor._cached that also notes results reused from the stage cache."""
+        built = []
+        def run():
+            built.append(stage)
+            return build()
+        value = self.processor._cached(stage, key, run)
+        if not built:
+            ctx.reused.add(id(value[0] if isinstance(value, tuple) else value))
+        return value
+
+    def _stage_background(self, ctx: RenderContext):
+        if ctx.canvas is not None or ctx.tiled:
+            return
+        target_w, target_h = ctx.layout.target_size
+        ctx.background = self._cached(ctx, 'background', ctx.keys['background'],
+            lambda: self.processor._create_background(ctx.background_source, target_w, target_h, ctx.settings))
+
+    def _stage_foreground(self, ctx: RenderContext):
+        if ctx.canvas is not None or ctx.tiled:
+            return
+        _, _, new_w, new_h = ctx.layout.content_rect
+        ctx.foreground = self._cached(ctx, 'foreground', ctx.keys['foreground'],
+            lambda: self.processor._create_foreground(ctx.image, new_w, new_h, ctx.settings))
+
+    def _stage_shadow(self, ctx: RenderContext):
+        if ctx.canvas is not None or ctx.tiled or ctx.keys['shadow'] is None:
+            return
+        _, _, new_w, new_h = ctx.layout.content_rect
+        ctx.shadow = self._cached(ctx, 'shadow', ctx.keys['shadow'],
+            lambda: self.processor._create_shadow(new_w, new_h, ctx.settings))
+
+    def _stage_composite(self, ctx: RenderContext):
+        if ctx.canvas is not None:
+            return
+        if ctx.tiled:
+            # Too large to hold intermediates in memory: skip the caches, build in strips
+            settings = ctx.settings
+            if 'shadow' in ctx.skipped:
+                settings = replace(settings, shadow_size=0)
+            ctx.canvas = self.processor.render_tiled(ctx.image, settings, ctx.layout.target_size,
+                                                     ctx.layout.content_rect, self.tile_budget)
+            return
+        ctx.canvas = self._cached(ctx, 'base', ctx.keys['composite'],
+            lambda: self.processor._composite(ctx.background, ctx.foreground, ctx.shadow, ctx.layout.content_rect))
+
+    def _stage_watermark(self, ctx: RenderContext):
+        settings = ctx.settings
+        if not settings.watermark.enabled:
+            return
+        if ctx.exif_data is None:
+            # Extract EXIF from ORIGINAL image
+            ctx.exif_data = self.watermarker.get_exif_data(ctx.image)
+        if ctx.overlay_watermark:
+            ctx.watermark = self.watermarker.render_sprite(ctx.canvas, settings.watermark, ctx.exif_data, ctx.layout.to_dict())
+            return
+        # A cached base canvas must stay intact, so only draw in place on a fresh one
+        stage_cache = self.processor.stage_cache
+        in_place = ctx.tiled or stage_cache is None or not stage_cache.caches('base')
+        ctx.canvas = self.watermarker.render_watermark(ctx.canvas, settings.watermark, ctx.exif_data, ctx.layout.to_dict(),
+                                                       in_place=in_place)
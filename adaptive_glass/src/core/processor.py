@@ -1,9 +1,18 @@
 from PIL import Image, ImageFilter, ImageOps, ImageDraw
+import math
 import os
 from .utils import ProcessingSettings, Ratio, BorderStyle, BlurMode
-from .watermark import WatermarkEngine
+from .cache import SHADOW_CACHE
+
+SHADOW_MAX_DOWNSCALE = 8
+BACKGROUND_DOWNSCALE = 4 # the background is blurred at 1/4 of the target size
 
 class ImageProcessor:
+    def __init__(self, stage_cache=None):
+        # Optional StageCache: reuse intermediate results whose settings did not change.
+        # Images returned from a cached render are shared and must be treated as read-only.
+        self.stage_cache = stage_cache
+
     def load_image(self, path: str) -> Image.Image:
         """Load an image from path."""
         try:
@@ -12,19 +21,48 @@ class ImageProcessor:
             print(f"Error loading image {path}: {e}")
             return None
 
-    def process(self, image: Image.Image, settings: ProcessingSettings) -> tuple[Image.Image, dict]:
-        """Main processing pipeline. Returns (image, layout_info)."""
-        if not image:
-            return None, {}
+    def process(self, image: Image.Image, settings: ProcessingSettings, exif_data: dict = None) -> tuple[Image.Image, dict]:
+        """Main processing pipeline. Returns (image, layout_info).
 
-        # 1. Calculate target dimensions
-        target_w, target_h = self._calculate_target_size(image.size, settings.target_ratio)
-        
-        # 2. Create background (Frosted Glass)
-        background = self._create_background(image, target_w, target_h, settings)
-        
-        # 3. Resize original image to fit within target dimensions (maintain aspect ratio)
-        img_w, img_h = image.size
+        Shortcut for RenderPipeline(self).render(); exif_data may be passed in
+        when already parsed (e.g. from SourceCache).
+        """
+        from .pipeline import RenderPipeline
+        return RenderPipeline(self).render(image, settings, exif_data)
+
+    def process_many(self, image: Image.Image, settings_list: list, exif_data: dict = None) -> list:
+        """Fan-out: one (image, layout_info) per settings, e.g. one per target ratio,
+        sharing decode, EXIF, the background downscale and equal foregrounds.
+
+        Shortcut for RenderPipeline(self).render_many().
+        """
+        from .pipeline import RenderPipeline
+        return list(RenderPipeline(self).render_many(image, settings_list, exif_data))
+
+    def _cached(self, stage: str, key: tuple, build):
+        if self.stage_cache is None:
+            return build()
+        value = self.stage_cache.get(stage, key)
+        if value is None:
+            value = build()
+            self.stage_cache.put(stage, key, value)
+        return value
+
+    # Stage keys come from the settings snapshot (a no-op for snapshots, a fresh one otherwise)
+    def _background_key(self, target_w: int, target_h: int, settings: ProcessingSettings) -> tuple:
+        return (target_w, target_h, settings.snapshot().stage_key('background'))
+
+    def _foreground_key(self, new_w: int, new_h: int, settings: ProcessingSettings) -> tuple:
+        return (new_w, new_h, settings.snapshot().stage_key('foreground'))
+
+    def _shadow_key(self, new_w: int, new_h: int, settings: ProcessingSettings) -> tuple:
+        if settings.shadow_size <= 0:
+            return None
+        return (new_w, new_h, settings.snapshot().stage_key('shadow'))
+
+    def _calculate_content_rect(self, original_size: tuple, target_w: int, target_h: int, settings: ProcessingSettings) -> tuple:
+        """Returns (x, y, w, h) of the centered foreground inside the target canvas."""
+        img_w, img_h = original_size
         scale = min(target_w / img_w, target_h / img_h)
         
         # Apply Content Scale
@@ -32,72 +70,176 @@ class ImageProcessor:
             scale = scale * (settings.content_scale / 100.0)
             
         new_w, new_h = int(img_w * scale), int(img_h * scale)
-        
-        # High quality resize
-        resized_img = image.resize((new_w, new_h), Image.Resampling.LANCZOS)
-        
-        # 4. Apply border to the resized image BEFORE pasting
-        if settings.border_style != BorderStyle.NONE:
-            resized_img = self._apply_border(resized_img, settings)
 
-        # 5. Composite
         # Center the image
         x = (target_w - new_w) // 2
         y = (target_h - new_h) // 2
-        
-        final_image = background.copy()
+        return x, y, new_w, new_h
+
+    def _composite(self, background: Image.Image, foreground: Image.Image, shadow: tuple, content_rect: tuple) -> Image.Image:
+        """Paste shadow and foreground onto a copy of the background."""
+        x, y, new_w, new_h = content_rect
+        # A cached background is shared and must stay untouched;
+        # otherwise composite straight onto it instead of allocating another canvas
+        shared = self.stage_cache is not None and self.stage_cache.caches('background')
+        final_image = background.copy() if shared else background
         
         # Apply Shadow
-        # Apply Shadow
-        if settings.shadow_size > 0:
-            # Optimization: Create shadow only for the area needed
-            # Make a shadow layer slightly larger than image
-            s_padding = settings.shadow_size * 3
-            s_w = new_w + s_padding * 2
-            s_h = new_h + s_padding * 2
-            
-            shadow_layer = Image.new('RGBA', (s_w, s_h), (0, 0, 0, 0))
-            shadow_draw = ImageDraw.Draw(shadow_layer)
-            
-            # Draw black rectangle in center of shadow layer
-            # If rounded, draw rounded
-            if settings.border_style == BorderStyle.ROUNDED:
-                shadow_draw.rounded_rectangle([s_padding, s_padding, s_padding+new_w, s_padding+new_h], 
-                                            radius=settings.corner_radius, fill=(0, 0, 0, 180)) # Semi-transparent black
-            else:
-                shadow_draw.rectangle([s_padding, s_padding, s_padding+new_w, s_padding+new_h], fill=(0, 0, 0, 180))
-            
-            # Blur shadow
-            shadow_layer = shadow_layer.filter(ImageFilter.GaussianBlur(settings.shadow_size))
+        if shadow is not None:
+            shadow_mask, s_padding = shadow
             
             # Paste shadow onto background
             # Offset to center shadow layer
-            sx = x - s_padding
-            sy = y - s_padding
-            
-            final_image.paste(shadow_layer, (sx, sy), shadow_layer)
+            self._paste_shadow(final_image, shadow_mask, (x - s_padding, y - s_padding))
+
+        final_image.paste(foreground, (x, y), foreground if foreground.mode == 'RGBA' else None)
+        return final_image
+
+    def _paste_shadow(self, canvas: Image.Image, shadow_mask: Image.Image, pos: tuple):
+        if canvas.mode == 'RGBA':
+            # Blend the shadow's own alpha too, as pasting an RGBA layer does
+            shadow_layer = Image.new('RGBA', shadow_mask.size, (0, 0, 0, 0))
+            shadow_layer.putalpha(shadow_mask)
+            canvas.paste(shadow_layer, pos, shadow_layer)
+        else:
+            canvas.paste(0 if canvas.mode == 'L' else (0, 0, 0), pos, shadow_mask)
+
+    def estimate_render_bytes(self, source_size: tuple, target_size: tuple, content_rect: tuple) -> int:
+        """Rough peak memory of a full-frame render: decoded source, background,
+        canvas, resized + bordered foreground and shadow mask."""
+        src_w, src_h = source_size
+        target_w, target_h = target_size
+        _, _, new_w, new_h = content_rect
+        return src_w * src_h * 4 + target_w * target_h * 4 * 2 + new_w * new_h * 9
+
+    def render_tiled(self, image: Image.Image, settings: ProcessingSettings, target_size: tuple,
+                     content_rect: tuple, tile_bytes: int) -> Image.Image:
+        """Build the base canvas (no watermark) in horizontal strips.
+
+        Each strip samples the small blurred background, the shadow and the matching
+        band of the resized foreground, so intermediate memory stays around tile_bytes
+        regardless of image size. Only the output canvas itself is full size.
+        """
+        target_w, target_h = target_size
+        x, y, new_w, new_h = content_rect
+        img_w, img_h = image.size
+
+        bg_small = self._create_background_small(image, target_w, target_h, settings)
+        canvas = Image.new(bg_small.mode, (target_w, target_h))
+        shadow = self._shadow_source(new_w, new_h, settings) if settings.shadow_size > 0 else None
+
+        # ~16 bytes per output pixel in flight: background strip, foreground band,
+        # its RGBA border copy and mask, shadow band
+        rows = max(16, tile_bytes // max(1, target_w * 16))
+        bg_scale = bg_small.height / target_h
+        fg_scale = img_h / new_h
+
+        for y0 in range(0, target_h, rows):
+            y1 = min(target_h, y0 + rows)
+
+            # Background strip
+            strip = bg_small.resize((target_w, y1 - y0), Image.Resampling.BICUBIC,
+                                    box=(0, y0 * bg_scale, bg_small.width, y1 * bg_scale))
+            canvas.paste(strip, (0, y0))
+            del strip
 
-        final_image.paste(resized_img, (x, y), resized_img if resized_img.mode == 'RGBA' else None)
+            # Shadow band
+            if shadow is not None:
+                small, box, s_padding = shadow
+                s_w = new_w + s_padding * 2
+                s_h = new_h + s_padding * 2
+                s_top = y - s_padding
+                r0, r1 = max(y0, s_top), min(y1, s_top + s_h)
+                if r0 < r1:
+                    ky = (box[3] - box[1]) / s_h
+                    band = small.resize((s_w, r1 - r0), Image.Resampling.BILINEAR,
+                                        box=(box[0], box[1] + (r0 - s_top) * ky, box[2], box[1] + (r1 - s_top) * ky))
+                    self._paste_shadow(canvas, band, (x - s_padding, r0))
+                    del band
+
+            # Foreground band
+            r0, r1 = max(y0, y), min(y1, y + new_h)
+            if r0 < r1:
+                band = image.resize((new_w, r1 - r0), Image.Resampling.LANCZOS,
+                                    box=(0, (r0 - y) * fg_scale, img_w, (r1 - y) * fg_scale))
+                if settings.border_style != BorderStyle.NONE:
+                    band = self._apply_border(band, settings, (new_w, new_h), r0 - y)
+                canvas.paste(band, (x, r0), band if band.mode == 'RGBA' else None)
+                del band
+
+        return canvas
+
+    def _create_foreground(self, image: Image.Image, new_w: int, new_h: int, settings: ProcessingSettings) -> Image.Image:
+        # High quality resize
+        resized_img = image.resize((new_w, new_h), Image.Resampling.LANCZOS)
         
-        # 6. Draw Watermark
-        if settings.watermark.enabled:
-            engine = WatermarkEngine()
-            exif_data = engine.get_exif_data(image)
-            
-            l_info = {
-                'target_size': (target_w, target_h),
-                'content_rect': (x, y, new_w, new_h)
-            }
-            
-            final_image = engine.render_watermark(final_image, settings.watermark, exif_data, l_info)
+        # Apply border to the resized image BEFORE pasting
+        if settings.border_style != BorderStyle.NONE:
+            resized_img = self._apply_border(resized_img, settings)
+        return resized_img
 
-        layout_info = {
-            'target_size': (target_w, target_h),
-            'content_rect': (x, y, new_w, new_h),
-            'content_scale': settings.content_scale
-        }
+    def _create_shadow(self, new_w: int, new_h: int, settings: ProcessingSettings) -> tuple:
+        """Returns (shadow_mask, padding). The mask is the shadow's alpha, full size."""
+        # Optimization: Create shadow only for the area needed
+        # Make a shadow layer slightly larger than image
+        small, box, s_padding = self._shadow_source(new_w, new_h, settings)
+        s_w = new_w + s_padding * 2
+        s_h = new_h + s_padding * 2
+
+        # box maps the small mask back onto exactly (s_w, s_h) full-size pixels
+        mask = small.resize((s_w, s_h), Image.Resampling.BILINEAR, box=box)
+        return mask, s_padding
+
+    def _shadow_source(self, new_w: int, new_h: int, settings: ProcessingSettings) -> tuple:
+        """Returns (small_mask, box, padding) for the reduced-resolution shadow."""
+        s_padding = int(settings.shadow_size * 3)
+
+        # The shadow is blurred anyway, so render it at reduced resolution.
+        # Small masks are shared process-wide: same-size camera output reuses one shadow.
+        key = self._shadow_key(new_w, new_h, settings)
+        cached = SHADOW_CACHE.get(key)
+        if cached is None:
+            cached = self._render_shadow_mask(s_padding, new_w, new_h, settings)
+            SHADOW_CACHE.put(key, cached)
+        small, box = cached
+        return small, box, s_padding
+
+    def _render_shadow_mask(self, s_padding: int, new_w: int, new_h: int, settings: ProcessingSettings) -> tuple:
+        """Draw and blur the shadow alpha at reduced resolution.
+
+        Returns (mask, box) where box is the region of mask covering the full-size layer.
+        """
+        # Keep at least ~4px of blur at the small size so the upscale stays smooth
+        factor = int(max(1, min(SHADOW_MAX_DOWNSCALE, settings.shadow_size // 4)))
+
+        # Snap the rectangle to whole small pixels, and remember the exact mapping
+        # so the upscaled edges land where the full-resolution ones would.
+        # (The full-size rectangle is inclusive, i.e. covers new_w + 1 pixels.)
+        rect_w = max(1, round((new_w + 1) / factor))
+        rect_h = max(1, round((new_h + 1) / factor))
+        kx = rect_w / (new_w + 1)
+        ky = rect_h / (new_h + 1)
+        pad = math.ceil(s_padding * max(kx, ky)) + 1
+        small_w = rect_w + pad * 2
+        small_h = rect_h + pad * 2
+
+        shadow_mask = Image.new('L', (small_w, small_h), 0)
+        shadow_draw = ImageDraw.Draw(shadow_mask)
+
+        # Draw black rectangle in center of shadow layer
+        # If rounded, draw rounded
+        if settings.border_style == BorderStyle.ROUNDED:
+            shadow_draw.rounded_rectangle([pad, pad, pad + rect_w - 1, pad + rect_h - 1],
+                                          radius=settings.corner_radius / factor, fill=180) # Semi-transparent black
+        else:
+            shadow_draw.rectangle([pad, pad, pad + rect_w - 1, pad + rect_h - 1], fill=180)
         
-        return final_image, layout_info
+        # Blur shadow
+        shadow_mask = shadow_mask.filter(ImageFilter.GaussianBlur(settings.shadow_size / factor))
+
+        box = (pad - s_padding * kx, pad - s_padding * ky,
+               pad + (new_w + s_padding) * kx, pad + (new_h + s_padding) * ky)
+        return shadow_mask, box
 
     def _calculate_target_size(self, original_size: tuple, ratio: Ratio) -> tuple:
         w, h = original_size
@@ -118,18 +260,37 @@ class ImageProcessor:
         return target_w_by_h, h
 
     def _create_background(self, image: Image.Image, target_w: int, target_h: int, settings: ProcessingSettings) -> Image.Image:
+        bg_small = self._create_background_small(image, target_w, target_h, settings)
+
+        # Upscale back to target size
+        # Use Bicubic or Lanczos for smoother upscale
+        return bg_small.resize((target_w, target_h), Image.Resampling.BICUBIC)
+
+    def _background_fill_scale(self, image_size: tuple, target_w: int, target_h: int) -> float:
+        """Scale at which the source fills the small (1/4) background."""
+        small_w = max(1, target_w // BACKGROUND_DOWNSCALE)
+        small_h = max(1, target_h // BACKGROUND_DOWNSCALE)
+        img_w, img_h = image_size
+        return max(small_w / img_w, small_h / img_h)
+
+    def _create_background_small(self, image: Image.Image, target_w: int, target_h: int, settings: ProcessingSettings) -> Image.Image:
+        """Blurred and toned background at 1/4 of the target size.
+
+        image may also be a downscaled copy of the source (see RenderPipeline.render_many).
+        """
         # Optimization: Process background at a lower resolution
         # This significantly reduces memory usage and improves speed for large images
         # The blur effect hides the loss of detail from downscaling
         
-        downscale_factor = 4 # Process at 1/4 resolution (1/16th pixels)
+        downscale_factor = BACKGROUND_DOWNSCALE # Process at 1/4 resolution (1/16th pixels)
         small_w = max(1, target_w // downscale_factor)
         small_h = max(1, target_h // downscale_factor)
         
         # Calculate scale to fill the SMALL target
         img_w, img_h = image.size
-        scale = max(small_w / img_w, small_h / img_h)
-        new_w, new_h = int(img_w * scale), int(img_h * scale)
+        scale = self._background_fill_scale(image.size, target_w, target_h)
+        # Clamped: float error (e.g. 355 / 528 * 528 = 354.99...) must not leave the crop short
+        new_w, new_h = max(small_w, int(img_w * scale)), max(small_h, int(img_h * scale))
         
         # Resize input image to the small size directly
         # Use Bilinear for speed, we are going to blur it anyway
@@ -141,6 +302,10 @@ class ImageProcessor:
         right = left + small_w
         bottom = top + small_h
         bg_small = bg_small.crop((left, top, right, bottom))
+
+        # Blur and the tone table below need plain 8-bit bands (e.g. not palette images)
+        if bg_small.mode not in ('L', 'RGB', 'RGBA'):
+            bg_small = bg_small.convert('RGBA' if 'A' in bg_small.getbands() or 'transparency' in bg_small.info else 'RGB')
         
         # Apply blur (scale radius down too)
         # We need to adjust blur radius because we are working on a smaller image.
@@ -150,37 +315,54 @@ class ImageProcessor:
         effective_radius = max(1, settings.blur_radius / downscale_factor)
         bg_small = bg_small.filter(ImageFilter.GaussianBlur(effective_radius))
         
-        # Apply Brightness Adjustment (New in V1.1)
-        if settings.blur_brightness != 0:
-            # 0 is neutral. Range -100 to 100.
-            # Map -100..100 to 0.0..2.0 multiplier? Or just use ImageEnhance.
-            from PIL import ImageEnhance
-            enhancer = ImageEnhance.Brightness(bg_small)
-            # 0 -> 1.0, 100 -> 2.0, -100 -> 0.0
-            factor = 1.0 + (settings.blur_brightness / 100.0)
-            bg_small = enhancer.enhance(factor)
-
-        # Upscale back to target size
-        # Use Bicubic or Lanczos for smoother upscale
-        bg_final = bg_small.resize((target_w, target_h), Image.Resampling.BICUBIC)
-        
+        # Brightness and the DARK/LIGHT glass tint are per-pixel affine maps, so they
+        # are fused into one lookup table and applied at the small resolution.
+        # The full-size background is then produced by a single upscale.
+        lut = self._background_tone_lut(bg_small.getbands(), settings)
+        if lut is not None:
+            bg_small = bg_small.point(lut)
+        return bg_small
 
+    def _background_tone_lut(self, bands: tuple, settings: ProcessingSettings) -> list:
+        """Lookup table for brightness + glass tint, or None when both are neutral."""
+        # 0 is neutral. Range -100 to 100.
+        # 0 -> 1.0, 100 -> 2.0, -100 -> 0.0 (same as ImageEnhance.Brightness)
+        factor = 1.0 + (settings.blur_brightness / 100.0)
 
-        # Apply overlay based on mode
+        # Overlay based on mode: (color, alpha)
+        overlay = None
         if settings.blur_mode == BlurMode.DARK:
-            overlay = Image.new('RGBA', bg_final.size, (0, 0, 0, 100)) # Black with ~40% opacity
-            bg_final.paste(overlay, (0, 0), overlay)
+            overlay = (0, 100) # Black with ~40% opacity
         elif settings.blur_mode == BlurMode.LIGHT:
-            overlay = Image.new('RGBA', bg_final.size, (255, 255, 255, 80)) # White with ~30% opacity
-            bg_final.paste(overlay, (0, 0), overlay)
-            
-        return bg_final
+            overlay = (255, 80) # White with ~30% opacity
+
+        if factor == 1.0 and overlay is None:
+            return None
+
+        def tint(v, overlay_value):
+            if overlay is None:
+                return v
+            alpha = overlay[1] / 255.0
+            return int(round(v * (1 - alpha) + overlay_value * alpha))
+
+        color_table = [tint(min(255, max(0, int(v * factor))), overlay[0] if overlay else 0) for v in range(256)]
+        # Brightness keeps alpha; the overlay blends its own alpha value into it
+        alpha_table = [tint(v, overlay[1] if overlay else 0) for v in range(256)]
+
+        lut = []
+        for band in bands:
+            lut.extend(alpha_table if band == 'A' else color_table)
+        return lut
 
-    def _apply_border(self, image: Image.Image, settings: ProcessingSettings) -> Image.Image:
+    def _apply_border(self, image: Image.Image, settings: ProcessingSettings, full_size: tuple = None, offset_y: int = 0) -> Image.Image:
+        """Apply the border. For a horizontal band of the foreground, pass the full
+        foreground size and the band's top row so the frame is drawn in place."""
         if settings.border_style == BorderStyle.NONE:
             return image
             
         w, h = image.size
+        full_w, full_h = full_size or (w, h)
+        top = -offset_y
         
         # Convert to RGBA for transparency support
         if image.mode != 'RGBA':
@@ -190,7 +372,7 @@ class ImageProcessor:
             # Draw a rectangle border
             draw = ImageDraw.Draw(image)
             bw = settings.border_width
-            draw.rectangle([0, 0, w-1, h-1], outline=settings.border_color, width=bw)
+            draw.rectangle([0, top, full_w-1, top+full_h-1], outline=settings.border_color, width=bw)
             return image
             
         elif settings.border_style == BorderStyle.ROUNDED:
@@ -198,7 +380,7 @@ class ImageProcessor:
             radius = settings.corner_radius
             mask = Image.new('L', (w, h), 0)
             draw = ImageDraw.Draw(mask)
-            draw.rounded_rectangle([0, 0, w, h], radius=radius, fill=255)
+            draw.rounded_rectangle([0, top, full_w, top+full_h], radius=radius, fill=255)
             
             # Apply mask
             output = Image.new('RGBA', (w, h), (0, 0, 0, 0))
@@ -207,7 +389,7 @@ class ImageProcessor:
             # Draw border outline if needed
             if settings.border_width > 0:
                 draw_out = ImageDraw.Draw(output)
-                draw_out.rounded_rectangle([0, 0, w-1, h-1], radius=radius, outline=settings.border_color, width=settings.border_width)
+                draw_out.rounded_rectangle([0, top, full_w-1, top+full_h-1], radius=radius, outline=settings.border_color, width=settings.border_width)
             
             return output
             
@@ -0,0 +1,68 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+class StageProfiler:
+    """Collects wall time, CPU time and allocated bytes per stage of one job.
+
+    Each entry is a dict with 'name', 'start' (time.perf_counter, comparable across
+    processes of one machine), 'wall' and 'cpu' (seconds), 'bytes', 'pid' and 'tid'.
+    CPU time is the calling thread's; Pillow releases the GIL but its work still
+    runs on that thread.
+    """
+
+    def __init__(self):
+        self.timings = []
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time the block. The yielded entry's 'bytes' can be set inside it."""
+        entry = {'name': name, 'start': time.perf_counter(), 'bytes': 0,
+                 'pid': os.getpid(), 'tid': threading.get_native_id()}
+        cpu_start = time.thread_time()
+        try:
+            yield entry
+        finally:
+            entry['wall'] = time.perf_counter() - entry['start']
+            entry['cpu'] = time.thread_time() - cpu_start
+            self.timings.append(entry)
+
+    def total(self) -> float:
+        return sum(t['wall'] for t in self.timings)
+
+class TraceRecorder:
+    """Thread-safe collector of stage timings from a whole batch, saved as a Chrome trace.
+
+    Open the file in chrome://tracing or https://ui.perfetto.dev: each worker
+    thread or process gets its own lane, and every stage shows its file, CPU time
+    and bytes.
+    """
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.events = []
+        self.lock = threading.Lock()
+
+    def add(self, timings: list, **args):
+        """Add StageProfiler entries; args (e.g. file=path) are attached to every event."""
+        events = []
+        for t in timings:
+            events.append({
+                'name': t['name'],
+                'ph': 'X',
+                'ts': round((t['start'] - self.origin) * 1e6, 1),
+                'dur': round(t['wall'] * 1e6, 1),
+                'pid': t['pid'],
+                'tid': t['tid'],
+                'args': dict(args, cpu_ms=round(t['cpu'] * 1000, 2), bytes=t['bytes'])
+            })
+        with self.lock:
+            self.events.extend(events)
+
+    def save(self, path: str):
+        with self.lock:
+            events = sorted(self.events, key=lambda e: e['ts'])
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f, ensure_ascii=False)
@@ -1,6 +1,9 @@
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, fields, replace, is_dataclass
 from enum import Enum
+from functools import cached_property
 from typing import Tuple, Optional
+import hashlib
+import json
 import sys
 import os
 
@@ -58,6 +61,9 @@ class WatermarkSettings:
     logo_path: Optional[str] = None
     size_scale: float = 1.0
 
+    def snapshot(self) -> "WatermarkSnapshot":
+        return WatermarkSnapshot(**{f.name: getattr(self, f.name) for f in fields(self)})
+
 @dataclass
 class ProcessingSettings:
     target_ratio: Ratio = Ratio.R_16_9
@@ -72,3 +78,153 @@ class ProcessingSettings:
     content_scale: int = 90 # 50-100%
     export_quality: int = 95
     watermark: WatermarkSettings = field(default_factory=WatermarkSettings)
+
+    def snapshot(self) -> "SettingsSnapshot":
+        """Immutable copy to hand to renders, worker threads and caches."""
+        values = {f.name: getattr(self, f.name) for f in fields(self)}
+        values['watermark'] = self.watermark.snapshot()
+        return SettingsSnapshot(**values)
+
+def _stable(value):
+    """JSON-ready form of a settings value, identical in every process."""
+    if isinstance(value, Enum):
+        return value.name
+    if is_dataclass(value):
+        return {f.name: _stable(getattr(value, f.name)) for f in fields(value)}
+    if isinstance(value, tuple):
+        return [_stable(v) for v in value]
+    return value
+
+def _digest(value) -> str:
+    data = json.dumps(_stable(value), sort_keys=True, ensure_ascii=False)
+    return hashlib.blake2b(data.encode('utf-8'), digest_size=16).hexdigest()
+
+def _fields_only(snapshot) -> dict:
+    """Pickle state of a snapshot: its fields without the cached values. hash() of str
+    and Enum values differs per process, so a cached _hash must not reach a worker."""
+    names = {f.name for f in fields(snapshot)}
+    return {k: v for k, v in snapshot.__dict__.items() if k in names}
+
+@dataclass(frozen=True, eq=True)
+class WatermarkSnapshot:
+    """Frozen WatermarkSettings, see SettingsSnapshot."""
+    enabled: bool
+    text: str
+    text_mode: WatermarkMode
+    text_color: str
+    font_size: int
+    auto_size: bool
+    opacity: int
+    position: str
+    custom_x: int
+    custom_y: int
+    font_path: str
+    use_exif: bool
+    logo_path: Optional[str]
+    size_scale: float
+
+    def snapshot(self) -> "WatermarkSnapshot":
+        return self
+
+    @cached_property
+    def _hash(self) -> int:
+        return hash(tuple(getattr(self, f.name) for f in fields(self)))
+
+    def __hash__(self):
+        return self._hash
+
+    __getstate__ = _fields_only
+
+@dataclass(frozen=True, eq=True)
+class SettingsSnapshot:
+    """Frozen, hashable ProcessingSettings, taken with ProcessingSettings.snapshot().
+
+    Safe to share between threads and processes without copies or locks, and
+    usable as a cache key; the hash is computed once. stage_key(stage) holds only
+    the values a render stage depends on, and digest / stage_digests are the
+    same hashes as hex strings, stable across processes and runs (for records on
+    disk). replace() and scale_settings() return new snapshots.
+    """
+    target_ratio: Ratio
+    blur_mode: BlurMode
+    blur_radius: int
+    blur_brightness: int
+    border_style: BorderStyle
+    border_color: str
+    border_width: int
+    corner_radius: int
+    shadow_size: int
+    content_scale: int
+    export_quality: int
+    watermark: WatermarkSnapshot
+
+    STAGES = ("layout", "background", "foreground", "shadow", "watermark", "export")
+
+    def snapshot(self) -> "SettingsSnapshot":
+        return self
+
+    @cached_property
+    def _hash(self) -> int:
+        return hash(tuple(getattr(self, f.name) for f in fields(self)))
+
+    def __hash__(self):
+        return self._hash
+
+    __getstate__ = _fields_only
+
+    @cached_property
+    def _stage_keys(self) -> dict:
+        # Every field must reach at least one stage, or the digest would miss it
+        if self.border_style == BorderStyle.NONE:
+            foreground = (BorderStyle.NONE,)
+        elif self.border_style == BorderStyle.THIN:
+            foreground = (BorderStyle.THIN, self.border_width, self.border_color)
+        else:
+            foreground = (self.border_style, self.border_width, self.border_color, self.corner_radius)
+        rounded = self.border_style == BorderStyle.ROUNDED
+        return {
+            'layout': (self.target_ratio, self.content_scale),
+            'background': (self.blur_radius, self.blur_brightness, self.blur_mode),
+            'foreground': foreground,
+            'shadow': (self.corner_radius if rounded else 0, self.shadow_size, rounded),
+            'watermark': (self.watermark,),
+            'export': (self.export_quality,)
+        }
+
+    def stage_key(self, stage: str) -> tuple:
+        """Hashable key of the settings one stage depends on (border values only
+        where the border style uses them, and so on)."""
+        return self._stage_keys[stage]
+
+    @cached_property
+    def stage_digests(self) -> dict:
+        return {stage: _digest(key) for stage, key in self._stage_keys.items()}
+
+    @cached_property
+    def digest(self) -> str:
+        """Stable hash of everything that affects the rendered output."""
+        return _digest([self.stage_digests[stage] for stage in self.STAGES])
+
+def scale_settings(settings: ProcessingSettings, factor: float) -> ProcessingSettings:
+    """Copy of settings (or a snapshot) with pixel-sized parameters scaled by factor.
+
+    Used for proxy (reduced-resolution) renders so they look like the export.
+    """
+    if factor == 1.0:
+        return settings
+
+    def scale_px(value):
+        # Keep non-zero sizes visible after scaling
+        return max(1, round(value * factor)) if value > 0 else value
+
+    wm = settings.watermark
+    watermark = replace(wm,
+                        font_size=scale_px(wm.font_size),
+                        custom_x=round(wm.custom_x * factor),
+                        custom_y=round(wm.custom_y * factor))
+    return replace(settings,
+                   blur_radius=settings.blur_radius * factor,
+                   border_width=scale_px(settings.border_width),
+                   corner_radius=settings.corner_radius * factor,
+                   shadow_size=settings.shadow_size * factor,
+                   watermark=watermark)
@@ -0,0 +1,114 @@
+import os
+import time
+from .batch import BatchRunner, SUPPORTED_EXTENSIONS, variant_suffix
+from .utils import ProcessingSettings
+
+DEFAULT_POLL_INTERVAL = 0.5 # seconds
+DEFAULT_SETTLE_TIME = 1.0 # a file must keep its size and mtime this long before it is processed
+
+def output_inside_input(input_dir: str, output_dir: str) -> bool:
+    """True if output_dir is input_dir or one of its subfolders."""
+    input_dir = os.path.normcase(os.path.realpath(input_dir))
+    output_dir = os.path.normcase(os.path.realpath(output_dir))
+    try:
+        return os.path.commonpath([input_dir, output_dir]) == input_dir
+    except ValueError:
+        # Different drives
+        return False
+
+class FolderWatcher:
+    """Hot-folder mode: poll input_dir and process new images as soon as they are fully written.
+
+    Polling uses one os.scandir per interval (no extra dependencies). A file is taken
+    once its size and mtime have stayed the same for settle_time, so files still being
+    copied or tethered in are left alone. Processing runs on a BatchRunner whose pools
+    stay warm for the whole session; its manifest in output_dir keeps files from being
+    reprocessed, also across restarts.
+
+    output_dir must not be input_dir or inside it; files that look like outputs
+    (recorded in the manifest, or named with the output suffix) are never taken.
+    """
+
+    def __init__(self, input_dir: str, output_dir: str, settings: ProcessingSettings,
+                 suffix: str = "_processed", out_format: str = "Auto",
+                 interval: float = DEFAULT_POLL_INTERVAL, settle_time: float = DEFAULT_SETTLE_TIME, **runner_options):
+        if output_inside_input(input_dir, output_dir):
+            raise ValueError(f"Output folder {output_dir} is inside the watched folder {input_dir}")
+        self.input_dir = input_dir
+        self.interval = interval
+        self.settle_time = settle_time
+        self.runner = BatchRunner([], output_dir, settings, suffix, out_format, **runner_options)
+        self.candidates = {} # path -> ((size, mtime_ns), first seen with that signature)
+        self.done = {} # path -> (size, mtime_ns) when handed to the runner
+        self.running = True
+        self.output_suffixes = tuple({variant_suffix(suffix, label) for label, _ in self.runner.variants} - {""})
+        # Absolute output paths, from the manifest and from every run of this session
+        self.outputs = set()
+
+    def scan(self) -> list:
+        """Return files that are new or changed and have stopped growing."""
+        now = time.monotonic()
+        ready = []
+        seen = set()
+        try:
+            entries = list(os.scandir(self.input_dir))
+        except OSError as e:
+            print(f"Error scanning {self.input_dir}: {e}")
+            return ready
+
+        for entry in entries:
+            if not entry.name.lower().endswith(SUPPORTED_EXTENSIONS) or self.is_output(entry.path):
+                continue
+            try:
+                if not entry.is_file():
+                    continue
+                st = entry.stat()
+            except OSError:
+                continue
+            path = entry.path
+            seen.add(path)
+            signature = (st.st_size, st.st_mtime_ns)
+            if self.done.get(path) == signature or st.st_size == 0:
+                continue
+
+            previous = self.candidates.get(path)
+            if previous is None or previous[0] != signature:
+                # New or still being written: start (or restart) the settle timer
+                self.candidates[path] = (signature, now)
+            elif now - previous[1] >= self.settle_time:
+                ready.append(path)
+                del self.candidates[path]
+                self.done[path] = signature
+
+        # Forget files that were removed
+        for path in list(self.candidates):
+            if path not in seen:
+                del self.candidates[path]
+        return sorted(ready)
+
+    def is_output(self, path: str) -> bool:
+        """True for a file this or an earlier batch wrote, which must not be processed again."""
+        if os.path.splitext(os.path.basename(path))[0].endswith(self.output_suffixes):
+            return True
+        return os.path.abspath(path) in self.outputs
+
+    def run(self, file_callback=None):
+        """Watch until stop(). file_callback(path, error) is called after each processed file."""
+        self.runner.open()
+        self.outputs.update(self.runner.manifest.entries)
+        try:
+            while self.running:
+                ready = self.scan()
+                if ready:
+                    self.runner.run(file_callback=file_callback, file_paths=ready)
+                    for path in ready:
+                        self.outputs.update(output_path for output_path, _ in self.runner.outputs_for(path))
+                    continue # check again right away: more files may have arrived meanwhile
+                self.runner.flush()
+                time.sleep(self.interval)
+        finally:
+            self.runner.close()
+
+    def stop(self):
+        self.running = False
+        self.runner.stop()
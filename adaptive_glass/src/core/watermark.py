@@ -1,5 +1,7 @@
 from PIL import Image, ImageDraw, ImageFont, ExifTags
 from .utils import WatermarkSettings, WatermarkMode
+from .fonts import FONT_CACHE
+from .cache import TEXT_SPRITE_CACHE
 import os
 import piexif
 
@@ -101,42 +103,76 @@ class WatermarkEngine:
             print(f"Error formatting template: {e}")
             return template
 
-    def render_watermark(self, image: Image.Image, settings: WatermarkSettings, exif_data: dict = None, layout_info: dict = None) -> Image.Image:
+    def render_watermark(self, image: Image.Image, settings: WatermarkSettings, exif_data: dict = None, layout_info: dict = None,
+                         in_place: bool = False) -> Image.Image:
+        """Draw the watermark onto image, keeping its mode.
+
+        Only the text's bounding box is composited. Pass in_place=True when the caller
+        owns image; otherwise a copy is drawn on.
+        """
         if not settings.enabled:
             return image
-            
+
+        overlay = self.render_sprite(image, settings, exif_data, layout_info)
+        if overlay is None:
+            return image
+        sprite, (left, top), _ = overlay
+
         # Create a copy to avoid modifying original
-        base_image = image.copy()
-        
+        base_image = image if in_place else image.copy()
+
+        # Clip the sprite to the canvas
+        box = (max(0, left), max(0, top),
+               min(base_image.width, left + sprite.width), min(base_image.height, top + sprite.height))
+        if box[0] >= box[2] or box[1] >= box[3]:
+            return base_image
+        sprite = sprite.crop((box[0] - left, box[1] - top, box[2] - left, box[3] - top))
+
+        # Composite just that region
+        region = base_image.crop(box)
+        if region.mode != 'RGBA':
+            region = Image.alpha_composite(region.convert('RGBA'), sprite).convert(base_image.mode)
+        else:
+            region = Image.alpha_composite(region, sprite)
+        base_image.paste(region, box[:2])
+        return base_image
+
+    def render_sprite(self, image: Image.Image, settings: WatermarkSettings, exif_data: dict = None, layout_info: dict = None):
+        """Render only the watermark text, cropped to its extent.
+
+        Returns (sprite, position, origin) or None when there is nothing to draw:
+        sprite is an RGBA image to composite at position on the canvas, origin is
+        the text block's top-left (the value "manual" position takes as custom_x/y).
+        The editor draws the sprite itself so dragging it needs no re-render.
+        """
         # Determine text
         text = settings.text
         
         # If text is empty or contains placeholders, we need EXIF
         if not text or ("{" in text and "}" in text):
             if not exif_data:
-                exif_data = self.get_exif_data(base_image)
+                exif_data = self.get_exif_data(image)
             
             if text:
                 text = self._format_template(text, exif_data)
         
-        # Load font
-        font_path_to_use = self.font_path
-        if settings.font_path and os.path.exists(settings.font_path):
-            font_path_to_use = settings.font_path
-            
         # --- 1. Advanced Layout Calculation ---
         
         # Default layout values
-        target_w, target_h = base_image.size
+        target_w, target_h = image.size
         content_rect = (0, 0, target_w, target_h)
         
         border_top = 0
         border_bottom = 0
         border_left = 0
         border_right = 0
+
+        # Proxy renders run at reduced resolution; fixed pixel sizes below scale with them
+        render_scale = 1.0
         
         if layout_info:
-            target_w, target_h = layout_info.get('target_size', base_image.size)
+            render_scale = layout_info.get('render_scale', 1.0)
+            target_w, target_h = layout_info.get('target_size', image.size)
             content_rect = layout_info.get('content_rect', (0, 0, target_w, target_h))
             cx, cy, cw, ch = content_rect
             
@@ -153,14 +189,15 @@ class WatermarkEngine:
             pos = settings.position
             
             # Determine if we are in a vertical zone (Top/Bottom) or horizontal/side zone
-            is_vertical_zone = "top" in pos or "bottom" in pos
+            # Manual positions keep the border-based size they had before dragging
+            is_vertical_zone = "top" in pos or "bottom" in pos or pos == "manual"
             
             if is_vertical_zone:
                 # Use the larger of top/bottom borders as reference if they exist
                 # This ensures consistency if top and bottom borders are similar
                 ref_border_h = max(border_top, border_bottom)
                 
-                if ref_border_h > 20:
+                if ref_border_h > 20 * render_scale:
                     # We have a meaningful border
                     base_font_size = int(ref_border_h * 0.35)
                 else:
@@ -172,7 +209,7 @@ class WatermarkEngine:
                 ref_border_w = max(border_left, border_right)
                 
                 if "left" in pos or "right" in pos:
-                    if ref_border_w > 20:
+                    if ref_border_w > 20 * render_scale:
                          # Fit within side border width (conservative)
                          # Assuming text might be long, we limit size based on width but also height to avoid huge text
                          base_font_size = int(ref_border_w * 0.15) # Heuristic
@@ -185,11 +222,11 @@ class WatermarkEngine:
                     base_font_size = int(target_w * 0.03)
             
             # Minimum size
-            base_font_size = max(12, base_font_size)
+            base_font_size = max(int(12 * render_scale), base_font_size)
         
         # Apply Manual Size Scale
         base_font_size = int(base_font_size * settings.size_scale)
-        base_font_size = max(10, base_font_size)
+        base_font_size = max(int(10 * render_scale), base_font_size, 1)
 
         # --- 3. Text Preparation ---
         model_text = ""
@@ -229,59 +266,41 @@ class WatermarkEngine:
                 model_text = text
         
         if not model_text and not info_text:
-            return image
+            return None
 
         # Chinese Font Fallback
         def has_chinese(s):
             return any('\u4e00' <= char <= '\u9fff' for char in s)
 
-        current_font_path = font_path_to_use
-        if has_chinese(model_text) or has_chinese(info_text):
-            if "SMILETSANS" in current_font_path.upper() or "ARIAL" in current_font_path.upper():
-                if os.name == 'nt':
-                    msyh = "C:\\Windows\\Fonts\\msyh.ttc"
-                    simhei = "C:\\Windows\\Fonts\\simhei.ttf"
-                    if os.path.exists(msyh): current_font_path = msyh
-                    elif os.path.exists(simhei): current_font_path = simhei
-
-        # Load Fonts
-        try:
-            font_model = ImageFont.truetype(current_font_path, base_font_size)
-            info_font_size = int(base_font_size * 0.7)
-            font_info = ImageFont.truetype(current_font_path, info_font_size)
-        except IOError:
+        # Load Fonts (cached process-wide)
+        cjk = has_chinese(model_text) or has_chinese(info_text)
+        current_font_path = FONT_CACHE.resolve(settings.font_path, self.font_path, cjk)
+        info_font_size = max(1, int(base_font_size * 0.7))
+        font_model = FONT_CACHE.get(current_font_path, base_font_size)
+        font_info = FONT_CACHE.get(current_font_path, info_font_size)
+        if font_model is None or font_info is None:
             font_model = ImageFont.load_default()
             font_info = ImageFont.load_default()
 
-        # Measure Text
-        draw_temp = ImageDraw.Draw(Image.new('RGBA', (1, 1)))
-        
-        def get_size(txt, font):
-            if not txt: return 0, 0
-            bbox = draw_temp.textbbox((0, 0), txt, font=font)
-            return bbox[2] - bbox[0], bbox[3] - bbox[1]
-            
-        w_model, h_model = get_size(model_text, font_model)
-        w_info, h_info = get_size(info_text, font_info)
-            
-        gap = int(base_font_size * 0.8) if (model_text and info_text) else 0
-        total_w = w_model + gap + w_info
-        max_h = max(h_model, h_info)
+        # Text sprites are cached process-wide: a shoot from one camera draws its text once
+        key = (model_text, info_text, current_font_path, base_font_size, info_font_size,
+               settings.text_color, settings.opacity)
+        rendered = TEXT_SPRITE_CACHE.get(key)
+        if rendered is None:
+            rendered = self._render_text(model_text, info_text, font_model, font_info, base_font_size, settings)
+            TEXT_SPRITE_CACHE.put(key, rendered)
+        sprite, (left, top), total_w, max_h = rendered
         
         # --- 4. Smart Positioning & Alignment ---
         
-        # Create layer
-        txt_layer = Image.new('RGBA', base_image.size, (255, 255, 255, 0))
-        draw = ImageDraw.Draw(txt_layer)
-        
         pos = settings.position
-        padding = 20
+        padding = int(20 * render_scale)
         x, y = 0, 0
         
         # Smart Y Calculation
         if "top" in pos:
             # Top Zone
-            if border_top > 20:
+            if border_top > 20 * render_scale:
                 # Center vertically in top border
                 center_y = border_top / 2
                 y = int(center_y - (max_h / 2))
@@ -289,7 +308,7 @@ class WatermarkEngine:
                 y = padding
         elif "bottom" in pos:
             # Bottom Zone
-            if border_bottom > 20:
+            if border_bottom > 20 * render_scale:
                 # Center vertically in bottom border
                 # Bottom border starts at (cy + ch)
                 start_y = content_rect[1] + content_rect[3]
@@ -304,7 +323,7 @@ class WatermarkEngine:
         # Smart X Calculation
         if "left" in pos:
             if "center" in pos: # center_left
-                if border_left > 20:
+                if border_left > 20 * render_scale:
                     # Center horizontally in left border
                     center_x = border_left / 2
                     x = int(center_x - (total_w / 2))
@@ -314,7 +333,7 @@ class WatermarkEngine:
                 x = padding
         elif "right" in pos:
             if "center" in pos: # center_right
-                if border_right > 20:
+                if border_right > 20 * render_scale:
                     # Center horizontally in right border
                     # Right border starts at (cx + cw)
                     start_x = content_rect[0] + content_rect[2]
@@ -327,7 +346,36 @@ class WatermarkEngine:
         else:
             # Center X (top_center, bottom_center, center)
             x = (target_w - total_w) // 2
+
+        if pos == "manual":
+            # Absolute top-left of the text block, set by dragging in the editor
+            x, y = settings.custom_x, settings.custom_y
             
+        return sprite, (x + left, y + top), (x, y)
+
+    def _render_text(self, model_text: str, info_text: str, font_model, font_info, base_font_size: int,
+                     settings: WatermarkSettings) -> tuple:
+        """Draw the text block with its origin at (0, 0).
+
+        Returns (sprite, sprite offset from the origin, block width, block height).
+        The sprite is shared through TEXT_SPRITE_CACHE and must not be modified.
+        """
+        # Measure Text
+        draw_temp = ImageDraw.Draw(Image.new('RGBA', (1, 1)))
+        
+        def get_size(txt, font):
+            if not txt: return 0, 0
+            bbox = draw_temp.textbbox((0, 0), txt, font=font)
+            return bbox[2] - bbox[0], bbox[3] - bbox[1]
+            
+        w_model, h_model = get_size(model_text, font_model)
+        w_info, h_info = get_size(info_text, font_info)
+            
+        gap = int(base_font_size * 0.8) if (model_text and info_text) else 0
+        total_w = w_model + gap + w_info
+        max_h = max(h_model, h_info)
+        x, y = 0, 0 # block origin; render_sprite places it
+
         # --- 5. Fixed Alignment (Bottom Baseline) ---
         
         # Colors
@@ -336,30 +384,37 @@ class WatermarkEngine:
         shadow_rgb = (0, 0, 0) if settings.text_color == "white" else (255, 255, 255)
         shadow_color = (*shadow_rgb, int(128 * (settings.opacity / 100)))
         
+        # Text positions (bottom aligned) and the sprite's extent, including the 1px shadow
+        y_model = y + (max_h - h_model)
+        x_info = x + w_model + gap
+        y_info = y + (max_h - h_info)
+
+        boxes = []
+        if model_text:
+            boxes.append(draw_temp.textbbox((x, y_model), model_text, font=font_model))
+        if info_text:
+            boxes.append(draw_temp.textbbox((x_info, y_info), info_text, font=font_info))
+        left = min(b[0] for b in boxes) - 1
+        top = min(b[1] for b in boxes) - 1
+        right = max(b[2] for b in boxes) + 2
+        bottom = max(b[3] for b in boxes) + 2
+
+        sprite = Image.new('RGBA', (right - left, bottom - top), (255, 255, 255, 0))
+        draw = ImageDraw.Draw(sprite)
+
         # Draw Model
         if model_text:
             # Always align bottom (Baseline)
             # The text block starts at y and has height max_h.
             # We want the bottom of the text to be at y + max_h.
             # So the top of the text should be at (y + max_h) - h_text.
-            
-            y_model = y + (max_h - h_model)
-
-            draw.text((x+1, y_model+1), model_text, font=font_model, fill=shadow_color)
-            draw.text((x, y_model), model_text, font=font_model, fill=color)
+            draw.text((x - left + 1, y_model - top + 1), model_text, font=font_model, fill=shadow_color)
+            draw.text((x - left, y_model - top), model_text, font=font_model, fill=color)
             
         # Draw Info
         if info_text:
-            x_info = x + w_model + gap
-            
             # Always align bottom (Baseline)
-            y_info = y + (max_h - h_info)
-            
-            draw.text((x_info+1, y_info+1), info_text, font=font_info, fill=shadow_color)
-            draw.text((x_info, y_info), info_text, font=font_info, fill=color)
-            
-        # Composite
-        if base_image.mode != 'RGBA':
-            base_image = base_image.convert('RGBA')
-            
-        return Image.alpha_composite(base_image, txt_layer)
+            draw.text((x_info - left + 1, y_info - top + 1), info_text, font=font_info, fill=shadow_color)
+            draw.text((x_info - left, y_info - top), info_text, font=font_info, fill=color)
+
+        return sprite, (left, top), total_w, max_h
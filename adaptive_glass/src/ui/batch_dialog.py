@@ -1,99 +1,55 @@
-import os
 from PyQt6.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QPushButton, 
                              QListWidget, QFileDialog, QLabel, QProgressBar, QMessageBox,
-                             QGroupBox, QFormLayout, QLineEdit, QComboBox)
+                             QGroupBox, QFormLayout, QLineEdit, QComboBox, QCheckBox)
 from src.core.utils import Ratio, BorderStyle
 from PyQt6.QtCore import QThread, pyqtSignal
-from src.core.processor import ImageProcessor
-from src.core.watermark import WatermarkEngine
-from PIL import Image
+from src.core.batch import BatchRunner
+from src.core.memory import MemoryReport, MEMORY_REPORT_NAME
+from src.core.watch import FolderWatcher, output_inside_input
 
 class BatchWorker(QThread):
     progress = pyqtSignal(int)
     finished = pyqtSignal()
     
-    def __init__(self, file_paths, output_dir, settings, suffix="_processed", out_format="Auto"):
+    def __init__(self, file_paths, output_dir, settings, suffix="_processed", out_format="Auto", backend="thread",
+                 resume=True, memory_report=False):
         super().__init__()
-        self.file_paths = file_paths
-        self.output_dir = output_dir
-        self.settings = settings
-        self.suffix = suffix
-        self.out_format = out_format
-        self.processor = ImageProcessor()
-        self.watermarker = WatermarkEngine()
-        self.running = True
+        # Snapshot: the dialog shares the settings panel's object, which keeps changing
+        settings = settings.snapshot()
+        # Per-image peak memory, saved to the output directory when the batch ends
+        self.memory_report = MemoryReport(settings) if memory_report else None
+        self.runner = BatchRunner(file_paths, output_dir, settings, suffix, out_format, backend=backend, resume=resume,
+                                  memory_report=self.memory_report)
 
     def run(self):
-        import concurrent.futures
-        
-        total = len(self.file_paths)
-        completed = 0
-        
-        # Determine max workers (CPU count)
-        max_workers = os.cpu_count() or 4
-        
-        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-            # Submit all tasks
-            future_to_file = {executor.submit(self.process_file, path): path for path in self.file_paths}
-            
-            for future in concurrent.futures.as_completed(future_to_file):
-                if not self.running:
-                    executor.shutdown(wait=False)
-                    break
-                    
-                path = future_to_file[future]
-                try:
-                    future.result()
-                except Exception as e:
-                    print(f"Error processing {path}: {e}")
-                
-                completed += 1
-                self.progress.emit(int(completed / total * 100))
-            
+        self.runner.run(progress_callback=self.on_progress)
         self.finished.emit()
 
-    def process_file(self, path):
-        # Load
-        img = self.processor.load_image(path)
-        if not img:
-            return
-            
-        # Process
-        processed, layout_info = self.processor.process(img, self.settings)
-        
-        # Watermark
-        if self.settings.watermark.enabled:
-            # Fix: Extract EXIF from ORIGINAL image
-            exif_data = self.watermarker.get_exif_data(img)
-            processed = self.watermarker.render_watermark(processed, self.settings.watermark, exif_data, layout_info)
-        
-        # Save
-        filename = os.path.basename(path)
-        name, ext = os.path.splitext(filename)
-        
-        # Determine output format and extension
-        save_ext = ext
-        if self.out_format == "PNG":
-            save_ext = ".png"
-        elif self.out_format == "JPG":
-            save_ext = ".jpg"
-        
-        save_name = f"{name}{self.suffix}{save_ext}"
-        save_path = os.path.join(self.output_dir, save_name)
-        
-        if save_ext.lower() in ['.jpg', '.jpeg']:
-            if processed.mode == 'RGBA':
-                processed = processed.convert('RGB')
-            processed.save(save_path, quality=self.settings.export_quality)
-        else:
-            processed.save(save_path)
-            
-        # Explicit cleanup
-        del img
-        del processed
+    def on_progress(self, completed, total):
+        self.progress.emit(int(completed / total * 100))
 
     def stop(self):
-        self.running = False
+        self.runner.stop()
+
+class WatchWorker(QThread):
+    """Hot-folder mode: processes files as they appear in input_dir until stopped."""
+    fileProcessed = pyqtSignal(str, str) # path, error ("" on success)
+
+    def __init__(self, input_dir, output_dir, settings, suffix="_processed", out_format="Auto", backend="thread"):
+        super().__init__()
+        # Snapshot: the settings panel keeps editing its object while we watch
+        self.watcher = FolderWatcher(input_dir, output_dir, settings.snapshot(), suffix, out_format, backend=backend)
+
+    def run(self):
+        self.watcher.run(file_callback=self.on_file)
+
+    def on_file(self, path, error):
+        self.fileProcessed.emit(path, error or "")
+
+    def stop(self):
+        """Ask the watcher to stop; the thread's finished signal follows once the
+        current scan or render is done."""
+        self.watcher.stop()
 
 class BatchDialog(QDialog):
     def __init__(self, settings, parent=None):
@@ -102,6 +58,10 @@ class BatchDialog(QDialog):
         self.resize(600, 500)
         self.settings = settings
         self.worker = None
+        self.watch_worker = None
+        self.close_pending = False # close once the watch thread has exited
+        self.watch_count = 0
+        self.watch_failed = 0
         
         self.init_ui()
 
@@ -163,6 +123,20 @@ class BatchDialog(QDialog):
         self.format_combo = QComboBox()
         self.format_combo.addItems(["Auto (原格式)", "PNG", "JPG"])
         opts_layout.addRow("输出格式:", self.format_combo)
+
+        # Processes avoid the GIL on multi-core machines, at the cost of a slower start
+        self.backend_combo = QComboBox()
+        self.backend_combo.addItem("多线程", "thread")
+        self.backend_combo.addItem("多进程 (多核更快)", "process")
+        opts_layout.addRow("并行方式:", self.backend_combo)
+
+        # Uses the processing record kept in the output directory
+        self.resume_check = QCheckBox("跳过已处理且未修改的图片")
+        self.resume_check.setChecked(True)
+        opts_layout.addRow(self.resume_check)
+
+        self.memory_check = QCheckBox(f"记录每张图片的内存占用 (保存为 {MEMORY_REPORT_NAME})")
+        opts_layout.addRow(self.memory_check)
         
         opts_group.setLayout(opts_layout)
         layout.addWidget(opts_group)
@@ -175,6 +149,16 @@ class BatchDialog(QDialog):
         out_layout.addWidget(self.out_label)
         out_layout.addWidget(self.out_btn)
         layout.addLayout(out_layout)
+
+        # Watch mode
+        watch_layout = QHBoxLayout()
+        self.watch_label = QLabel("监视模式: 未启动")
+        self.watch_btn = QPushButton("监视文件夹...")
+        self.watch_btn.clicked.connect(self.toggle_watch)
+        self.watch_btn.setEnabled(False)
+        watch_layout.addWidget(self.watch_label)
+        watch_layout.addWidget(self.watch_btn)
+        layout.addLayout(watch_layout)
         
         # Progress
         self.progress_bar = QProgressBar()
@@ -212,6 +196,71 @@ class BatchDialog(QDialog):
             self.start_btn.setEnabled(True)
         else:
             self.start_btn.setEnabled(False)
+        self.watch_btn.setEnabled(bool(self.output_dir))
+
+    def toggle_watch(self):
+        if self.watch_worker:
+            self.stop_watch()
+            return
+
+        input_dir = QFileDialog.getExistingDirectory(self, "选择要监视的输入目录")
+        if not input_dir:
+            return
+        if output_inside_input(input_dir, self.output_dir):
+            QMessageBox.warning(self, "无法监视", "输出目录不能是监视目录或其子目录，否则输出的图片会被再次处理。")
+            return
+        fmt_text = self.format_combo.currentText()
+        out_format = "Auto"
+        if "PNG" in fmt_text: out_format = "PNG"
+        elif "JPG" in fmt_text: out_format = "JPG"
+
+        self.watch_count = 0
+        self.watch_failed = 0
+        self.watch_input_dir = input_dir
+        self.watch_worker = WatchWorker(input_dir, self.output_dir, self.settings, self.suffix_edit.text(),
+                                        out_format, self.backend_combo.currentData())
+        self.watch_worker.fileProcessed.connect(self.on_watch_file)
+        self.watch_worker.finished.connect(self.on_watch_stopped)
+        self.watch_worker.start()
+
+        self.watch_btn.setText("停止监视")
+        self.watch_label.setText(f"监视中: {input_dir}")
+        self.start_btn.setEnabled(False)
+        self.out_btn.setEnabled(False)
+
+    def stop_watch(self):
+        # Not waiting here: the UI stays responsive until on_watch_stopped
+        self.watch_worker.stop()
+        self.watch_btn.setEnabled(False)
+        self.watch_btn.setText("正在停止...")
+
+    def on_watch_stopped(self):
+        self.watch_worker = None
+        self.watch_btn.setText("监视文件夹...")
+        self.watch_label.setText(f"监视模式: 已停止 (已处理 {self.watch_count} 张)")
+        self.check_ready()
+        self.out_btn.setEnabled(True)
+        if self.close_pending:
+            self.close()
+
+    def on_watch_file(self, path, error):
+        if error:
+            self.watch_failed += 1
+        else:
+            self.watch_count += 1
+        status = f"监视中: {self.watch_input_dir} (已处理 {self.watch_count} 张"
+        if self.watch_failed:
+            status += f", 失败 {self.watch_failed} 张"
+        self.watch_label.setText(status + ")")
+
+    def closeEvent(self, event):
+        if self.watch_worker:
+            # Close for real once the watch thread has exited
+            self.close_pending = True
+            self.stop_watch()
+            event.ignore()
+            return
+        super().closeEvent(event)
 
     def start_processing(self):
         files = [self.file_list.item(i).text() for i in range(self.file_list.count())]
@@ -221,7 +270,9 @@ class BatchDialog(QDialog):
         if "PNG" in fmt_text: out_format = "PNG"
         elif "JPG" in fmt_text: out_format = "JPG"
         
-        self.worker = BatchWorker(files, self.output_dir, self.settings, suffix, out_format)
+        self.worker = BatchWorker(files, self.output_dir, self.settings, suffix, out_format,
+                                  self.backend_combo.currentData(), self.resume_check.isChecked(),
+                                  self.memory_check.isChecked())
         self.worker.progress.connect(self.progress_bar.setValue)
         self.worker.finished.connect(self.on_finished)
         
@@ -231,15 +282,26 @@ class BatchDialog(QDialog):
         self.out_btn.setEnabled(False)
         self.suffix_edit.setEnabled(False)
         self.format_combo.setEnabled(False)
+        self.backend_combo.setEnabled(False)
+        self.resume_check.setEnabled(False)
+        self.memory_check.setEnabled(False)
+        self.watch_btn.setEnabled(False)
         
         self.worker.start()
 
     def on_finished(self):
-        QMessageBox.information(self, "完成", "批量处理已完成！")
+        message = "批量处理已完成！"
+        if self.worker.memory_report is not None:
+            message += "\n\n" + self.worker.memory_report.summary(5)
+        QMessageBox.information(self, "完成", message)
         self.start_btn.setEnabled(True)
         self.add_btn.setEnabled(True)
         self.clear_btn.setEnabled(True)
         self.out_btn.setEnabled(True)
         self.suffix_edit.setEnabled(True)
         self.format_combo.setEnabled(True)
+        self.backend_combo.setEnabled(True)
+        self.resume_check.setEnabled(True)
+        self.memory_check.setEnabled(True)
+        self.watch_btn.setEnabled(True)
         self.progress_bar.setValue(0)
@@ -6,9 +6,32 @@ from PyQt6.QtCore import Qt
 
 from src.ui.preview import PreviewWidget
 from src.ui.settings import SettingsPanel
-from src.ui.workers import ImageWorker, SaveWorker
+from src.ui.workers import RenderService, SaveWorker
 from src.ui.batch_dialog import BatchDialog
 from src.ui.styles import DARK_THEME
+from src.core.cache import SourceCache, StageCache
+
+STAGE_NAMES = {
+    "load": "读取", "layout": "布局", "background": "背景", "foreground": "前景",
+    "shadow": "阴影", "composite": "合成", "watermark": "水印"
+}
+
+def format_timings(timings) -> str:
+    """Status bar summary of a render's stage timings, e.g. "120 ms (背景 80 · 前景 35)"."""
+    if not timings:
+        return ""
+    total = sum(t['wall'] for t in timings) * 1000
+    # Stages that took under a millisecond (e.g. served from the cache) are left out
+    parts = [f"{STAGE_NAMES.get(t['name'], t['name'])} {t['wall'] * 1000:.0f}" for t in timings if t['wall'] >= 0.001]
+    return f"{total:.0f} ms ({' · '.join(parts)})" if parts else f"{total:.0f} ms"
+
+def format_timings_detail(timings) -> str:
+    """One line per stage with wall time, CPU time and allocated memory."""
+    lines = []
+    for t in timings or ():
+        lines.append(f"{STAGE_NAMES.get(t['name'], t['name'])}: {t['wall'] * 1000:.1f} ms, "
+                     f"CPU {t['cpu'] * 1000:.1f} ms, {t['bytes'] / (1024 * 1024):.1f} MB")
+    return "\n".join(lines)
 
 class MainWindow(QMainWindow):
     def __init__(self):
@@ -18,8 +41,18 @@ class MainWindow(QMainWindow):
         self.setStyleSheet(DARK_THEME)
         
         self.current_image_path = None
-        self.worker = None
         self.save_worker = None
+        # Decoded sources + EXIF, so setting tweaks never touch the disk
+        self.source_cache = SourceCache()
+        # Intermediate render stages, so an edit only re-runs the stages it affects
+        self.stage_cache = StageCache()
+        # One persistent render thread; rapid edits coalesce instead of killing threads
+        self.render_service = RenderService(self.source_cache, self.stage_cache)
+        self.render_service.resultReady.connect(self.on_processing_finished)
+        self.render_service.start()
+        self.render_generation = 0
+        self.render_size = None # proxy bound of the last requested render
+        self.watermark_overlay = None
         
         self.init_ui()
         self.setup_actions()
@@ -42,6 +75,7 @@ class MainWindow(QMainWindow):
         # Preview
         self.preview = PreviewWidget()
         self.preview.watermarkMoved.connect(self.on_watermark_moved)
+        self.preview.resizeSettled.connect(self.on_preview_resized)
         splitter.addWidget(self.preview)
         
         # Settings
@@ -122,34 +156,56 @@ class MainWindow(QMainWindow):
             
         settings = self.settings_panel.settings
         
-        # Cancel previous worker if running
-        if self.worker and self.worker.isRunning():
-            self.worker.terminate()
-            self.worker.wait()
-            
-        self.worker = ImageWorker(self.current_image_path, settings)
-        self.worker.resultReady.connect(self.on_processing_finished)
-        self.worker.start()
+        # Supersedes any pending render; the running one is cancelled between stages
+        self.render_size = self.preview_render_size()
+        self.render_generation = self.render_service.request(self.current_image_path, settings,
+                                                             self.render_size)
         self.status_bar.showMessage("处理中...")
 
-    def on_processing_finished(self, qimage):
-        self.preview.set_image(qimage)
-        self.status_bar.showMessage("处理完成")
+    def preview_render_size(self):
+        """Proxy bound in device pixels, rounded up so small window resizes reuse the cached proxy."""
+        dpr = self.preview.devicePixelRatioF()
+        step = 256
+        w = int(self.preview.width() * dpr)
+        h = int(self.preview.height() * dpr)
+        return (max(step, -(-w // step) * step), max(step, -(-h // step) * step))
+
+    def on_preview_resized(self):
+        """Re-render once the preview has grown past the current proxy (in 256 px steps);
+        shrinking keeps the larger proxy, which just scales down."""
+        if not self.current_image_path or self.render_size is None:
+            return
+        w, h = self.preview_render_size()
+        if w > self.render_size[0] or h > self.render_size[1]:
+            self.process_image()
+
+    def on_processing_finished(self, qimage, overlay, timings, generation):
+        if generation != self.render_generation:
+            # A newer request was made after this result was queued
+            return
+        self.watermark_overlay = overlay
+        self.preview.set_image(qimage, overlay)
+        self.status_bar.showMessage(f"处理完成 {format_timings(timings)}")
+        self.status_bar.setToolTip(format_timings_detail(timings))
 
     def on_settings_changed(self, settings):
         self.process_image()
 
     def on_watermark_moved(self, dx, dy):
-        # Update settings with new position
+        """Drag released: dx, dy are in preview pixels, settings are in full-resolution pixels."""
+        overlay = self.watermark_overlay
+        if overlay is None:
+            return
         current_settings = self.settings_panel.settings
+        scale = overlay['render_scale']
         
         if current_settings.watermark.position != "manual":
+            # Start from where the watermark is drawn now
+            current_settings.watermark.custom_x, current_settings.watermark.custom_y = overlay['origin']
             self.settings_panel.set_position_mode("manual")
-            # We might want to initialize custom_x/y to a reasonable start if they were 0
-            # But for now, let's just let them accumulate delta.
             
-        current_settings.watermark.custom_x += dx
-        current_settings.watermark.custom_y += dy
+        current_settings.watermark.custom_x += round(dx / scale)
+        current_settings.watermark.custom_y += round(dy / scale)
         
         # Trigger update
         self.process_image()
@@ -180,13 +236,11 @@ class MainWindow(QMainWindow):
         file_path, _ = QFileDialog.getSaveFileName(self, "保存图片", default_path, filters, selected_filter)
         
         if file_path:
-            quality = self.settings_panel.settings.export_quality
-            
             # Disable UI
             self.status_bar.showMessage("正在导出...")
             self.setEnabled(False)
             
-            self.save_worker = SaveWorker(self.preview.image, file_path, quality)
+            self.save_worker = SaveWorker(self.current_image_path, self.settings_panel.settings, file_path, self.source_cache)
             self.save_worker.finished.connect(self.on_save_finished)
             self.save_worker.start()
 
@@ -217,4 +271,5 @@ class MainWindow(QMainWindow):
 
     def closeEvent(self, event):
         print("MainWindow: closeEvent triggered")
+        self.render_service.stop()
         super().closeEvent(event)
@@ -1,22 +1,38 @@
 from PyQt6.QtWidgets import QWidget, QLabel, QVBoxLayout, QSizePolicy
 from PyQt6.QtGui import QImage, QPixmap, QPainter, QColor, QPen
-from PyQt6.QtCore import Qt, pyqtSignal, QPoint, QSize
+from PyQt6.QtCore import Qt, pyqtSignal, QPoint, QSize, QRect, QTimer
 
 class PreviewWidget(QWidget):
-    watermarkMoved = pyqtSignal(int, int) # Emits new x, y
+    watermarkMoved = pyqtSignal(int, int) # Drag delta in image pixels, emitted on release
+    resizeSettled = pyqtSignal() # the widget stopped resizing (debounced)
+
+    RESIZE_SETTLE_MS = 150 # smooth rescale once the window stops resizing
 
     def __init__(self):
         super().__init__()
         self.image = None
         self.pixmap = None
         self.scaled_pixmap = None
+        self.overlay = None # watermark sprite info from RenderService
+        self.overlay_pixmap = None
         self.scale_factor = 1.0
         self.offset_x = 0
         self.offset_y = 0
+
+        # During a resize the full pixmap is drawn with fast scaling; the smooth
+        # scaled_pixmap is rebuilt once when the timer fires
+        self.resizing = False
+        self.resize_timer = QTimer(self)
+        self.resize_timer.setSingleShot(True)
+        self.resize_timer.setInterval(self.RESIZE_SETTLE_MS)
+        self.resize_timer.timeout.connect(self.on_resize_settled)
         
         # Dragging state
         self.dragging = False
         self.last_mouse_pos = QPoint()
+        # Sprite offset (image pixels) while dragging, kept until the re-render arrives
+        self.drag_dx = 0.0
+        self.drag_dy = 0.0
         
         self.init_ui()
 
@@ -25,18 +41,29 @@ class PreviewWidget(QWidget):
         self.setMinimumSize(400, 300)
         self.setStyleSheet("background-color: #2b2b2b;")
 
-    def set_image(self, image):
-        """Set the QImage to display."""
+    def set_image(self, image, overlay=None):
+        """Set the QImage to display, plus the watermark overlay drawn on top of it."""
         self.image = image
+        self.scaled_pixmap = None
+        self.overlay = overlay
+        self.overlay_pixmap = QPixmap.fromImage(overlay['image']) if overlay else None
+        if not self.dragging:
+            self.drag_dx = self.drag_dy = 0.0
         if self.image:
             self.pixmap = QPixmap.fromImage(self.image)
-            self.update_scaled_pixmap()
+            self.update_scaled_pixmap(smooth=not self.resizing)
         else:
             self.pixmap = None
             self.scaled_pixmap = None
         self.update()
 
-    def update_scaled_pixmap(self):
+    def fitted_rect(self) -> QRect:
+        """Widget rect the pixmap occupies when scaled to fit, keeping aspect ratio."""
+        size = self.pixmap.size().scaled(self.width(), self.height(), Qt.AspectRatioMode.KeepAspectRatio)
+        return QRect((self.width() - size.width()) // 2, (self.height() - size.height()) // 2,
+                     size.width(), size.height())
+
+    def update_scaled_pixmap(self, smooth=True):
         if not self.pixmap:
             return
             
@@ -46,33 +73,62 @@ class PreviewWidget(QWidget):
         
         if w <= 0 or h <= 0:
             return
-            
-        self.scaled_pixmap = self.pixmap.scaled(w, h, Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation)
-        
-        # Calculate offset to center
-        self.offset_x = (w - self.scaled_pixmap.width()) // 2
-        self.offset_y = (h - self.scaled_pixmap.height()) // 2
-        
+
+        rect = self.fitted_rect()
+        self.offset_x = rect.x()
+        self.offset_y = rect.y()
+
         # Calculate scale factor (original -> displayed)
-        self.scale_factor = self.scaled_pixmap.width() / self.pixmap.width()
+        self.scale_factor = rect.width() / self.pixmap.width()
+
+        if not smooth:
+            # Keep the old scaled pixmap; paintEvent draws the full one fast
+            return
+
+        # Reuse the cached pixmap when the displayed size has not changed
+        if self.scaled_pixmap is not None and self.scaled_pixmap.size() == rect.size():
+            return
+        self.scaled_pixmap = self.pixmap.scaled(rect.size(), Qt.AspectRatioMode.IgnoreAspectRatio, Qt.TransformationMode.SmoothTransformation)
 
     def resizeEvent(self, event):
-        self.update_scaled_pixmap()
+        self.resizing = True
+        self.update_scaled_pixmap(smooth=False)
+        self.resize_timer.start()
         super().resizeEvent(event)
 
+    def on_resize_settled(self):
+        self.resizing = False
+        self.update_scaled_pixmap()
+        self.update()
+        self.resizeSettled.emit()
+
     def paintEvent(self, event):
         painter = QPainter(self)
         
-        if self.scaled_pixmap:
-            painter.setRenderHint(QPainter.RenderHint.Antialiasing)
-            painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform)
+        if self.pixmap and (self.resizing or not self.scaled_pixmap):
+            # Fast scaling while the window is being resized
+            painter.drawPixmap(self.fitted_rect(), self.pixmap)
+        elif self.scaled_pixmap:
             painter.drawPixmap(self.offset_x, self.offset_y, self.scaled_pixmap)
         else:
             painter.setPen(QColor(100, 100, 100))
             painter.drawText(self.rect(), Qt.AlignmentFlag.AlignCenter, "拖入图片或点击打开")
 
+        if self.pixmap and self.overlay_pixmap:
+            self.paint_overlay(painter)
+
+    def paint_overlay(self, painter):
+        """Composite the watermark sprite at its (possibly dragged) position."""
+        x, y = self.overlay['position']
+        s = self.scale_factor
+        target = QRect(self.offset_x + round((x + self.drag_dx) * s), self.offset_y + round((y + self.drag_dy) * s),
+                       round(self.overlay_pixmap.width() * s), round(self.overlay_pixmap.height() * s))
+        painter.setClipRect(self.fitted_rect())
+        painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform, not self.resizing)
+        painter.drawPixmap(target, self.overlay_pixmap)
+
     def mousePressEvent(self, event):
-        if event.button() == Qt.MouseButton.LeftButton:
+        if event.button() == Qt.MouseButton.LeftButton and self.overlay:
             self.dragging = True
             self.last_mouse_pos = event.pos()
 
@@ -81,18 +137,15 @@ class PreviewWidget(QWidget):
             delta = event.pos() - self.last_mouse_pos
             self.last_mouse_pos = event.pos()
             
-            # Convert delta to original image coordinates
-            dx = int(delta.x() / self.scale_factor)
-            dy = int(delta.y() / self.scale_factor)
-            
-            # Emit signal to update watermark position
-            # Note: This assumes the parent will handle the logic of "current pos + delta"
-            # But since we don't store the absolute watermark pos here, we might need to change logic.
-            # For now, let's just emit the delta and let the main window handle it?
-            # Or better, emit a signal that we are dragging.
-            
-            self.watermarkMoved.emit(dx, dy)
+            # Convert delta to original image coordinates and move the sprite locally;
+            # the pipeline only re-renders once the drag ends
+            self.drag_dx += delta.x() / self.scale_factor
+            self.drag_dy += delta.y() / self.scale_factor
+            self.update()
 
     def mouseReleaseEvent(self, event):
-        if event.button() == Qt.MouseButton.LeftButton:
+        if event.button() == Qt.MouseButton.LeftButton and self.dragging:
             self.dragging = False
+            dx, dy = round(self.drag_dx), round(self.drag_dy)
+            if dx or dy:
+                self.watermarkMoved.emit(dx, dy)
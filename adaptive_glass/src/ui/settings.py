@@ -234,6 +234,7 @@ class SettingsPanel(QWidget):
         self.wm_position.addItem("居中", "center")
         self.wm_position.addItem("居中居右", "center_right")
         self.wm_position.addItem("居中居左", "center_left")
+        self.wm_position.addItem("手动位置", "manual") # set by dragging in the preview
         self.set_position_mode(self.settings.watermark.position) # Fix: Init from settings
         self.wm_position.currentIndexChanged.connect(self.update_settings)
         
@@ -1,68 +1,156 @@
 from PyQt6.QtCore import QThread, pyqtSignal
-import os
+import threading
 from PyQt6.QtGui import QImage
 from PIL import Image
 from src.core.processor import ImageProcessor
-from src.core.watermark import WatermarkEngine
+from src.core.pipeline import RenderPipeline, RenderCancelled
+from src.core.batch import save_image
+from src.core.profiling import StageProfiler
 from src.core.utils import ProcessingSettings
 
-class ImageWorker(QThread):
-    resultReady = pyqtSignal(QImage)
+def pil_to_qimage(image: Image.Image) -> QImage:
+    """Wrap a PIL image's pixels in a QImage with a single copy.
+
+    The QImage points straight at the bytes from tobytes() (no channel swizzle,
+    no QImage.copy()); the buffer is kept alive as an attribute of the QImage
+    wrapper, so the wrapper itself must be passed around (signal type object).
+    """
+    if image.mode == "RGB":
+        fmt, bpp = QImage.Format.Format_RGB888, 3
+    elif image.mode == "L":
+        fmt, bpp = QImage.Format.Format_Grayscale8, 1
+    else:
+        if image.mode != "RGBA":
+            image = image.convert("RGBA")
+        fmt, bpp = QImage.Format.Format_RGBA8888, 4
+
+    data = image.tobytes("raw", image.mode)
+    qim = QImage(data, image.width, image.height, image.width * bpp, fmt)
+    qim._buffer = data
+    return qim
+
+class RenderService(QThread):
+    """Long-lived preview render thread.
+
+    Holds a queue of depth one: request() replaces any pending job, and the
+    in-flight render is cancelled cooperatively between pipeline stages. Every
+    request gets a generation number; results of older generations are dropped.
+
+    The watermark is delivered separately from the canvas, as a sprite the
+    preview composites itself, so dragging it needs no re-render.
+    """
+    # QImage wrapper (shares its pixel buffer, see pil_to_qimage), watermark overlay
+    # dict or None, stage timings (StageProfiler entries), generation
+    resultReady = pyqtSignal(object, object, object, int)
     
-    def __init__(self, image_path, settings):
+    def __init__(self, source_cache=None, stage_cache=None):
         super().__init__()
-        self.image_path = image_path
-        self.settings = settings
-        self.processor = ImageProcessor()
-        self.watermarker = WatermarkEngine()
-        self.loaded_image = None
+        self.pipeline = RenderPipeline(ImageProcessor(stage_cache))
+        self.source_cache = source_cache
+        self.condition = threading.Condition()
+        self.generation = 0
+        self.pending = None # (generation, image_path, settings, preview_size)
+        self.stopping = False
+
+    def request(self, image_path, settings, preview_size=None) -> int:
+        """Queue a render, superseding any pending or running one. Returns its generation."""
+        # Snapshot: the settings panel keeps mutating its object on the UI thread
+        settings = settings.snapshot()
+        with self.condition:
+            self.generation += 1
+            self.pending = (self.generation, image_path, settings, preview_size)
+            self.condition.notify()
+            return self.generation
+
+    def stop(self):
+        with self.condition:
+            self.stopping = True
+            self.pending = None
+            self.condition.notify()
+        self.wait()
+
+    def is_stale(self, generation) -> bool:
+        return self.stopping or generation != self.generation
 
     def run(self):
-        if not self.loaded_image and self.image_path:
-            self.loaded_image = self.processor.load_image(self.image_path)
-            
-        if self.loaded_image:
-            # 1. Process (Resize + Blur + Border)
-            processed, layout_info = self.processor.process(self.loaded_image, self.settings)
-            
-            # 2. Watermark
-            if self.settings.watermark.enabled:
-                # Extract EXIF from ORIGINAL image
-                exif_data = self.watermarker.get_exif_data(self.loaded_image)
-                processed = self.watermarker.render_watermark(processed, self.settings.watermark, exif_data, layout_info)
-            
-            # Convert to QImage
-            # Ensure we have RGBA for consistency
-            if processed.mode != "RGBA":
-                processed = processed.convert("RGBA")
-                
-            data = processed.tobytes("raw", "BGRA")
-            # Create QImage from data. IMPORTANT: Must .copy() to ensure QImage owns the data
-            # because 'data' is a local variable and will be garbage collected.
-            qim = QImage(data, processed.width, processed.height, QImage.Format.Format_ARGB32).copy()
-            
-            self.resultReady.emit(qim)
-
-    def update_settings(self, settings):
-        self.settings = settings
-        self.start()
+        while True:
+            with self.condition:
+                while self.pending is None and not self.stopping:
+                    self.condition.wait()
+                if self.stopping:
+                    return
+                job = self.pending
+                self.pending = None
+
+            try:
+                result = self.render(*job)
+            except RenderCancelled:
+                continue
+            except Exception as e:
+                print(f"Error rendering preview: {e}")
+                continue
+
+            if result is not None and not self.is_stale(job[0]):
+                self.resultReady.emit(*result, job[0])
+
+    def render(self, generation, image_path, settings, preview_size):
+        cancel = lambda: self.is_stale(generation)
+        render_scale = 1.0
+        profiler = StageProfiler()
+        with profiler.stage("load"):
+            if self.source_cache and preview_size:
+                # Reduced-resolution proxy; full resolution is only rendered on save
+                image, exif_data, render_scale = self.source_cache.get_proxy(image_path, preview_size)
+            elif self.source_cache:
+                # Decoded pixels and EXIF are reused across edits of the same file
+                image, exif_data = self.source_cache.get(image_path)
+            else:
+                image, exif_data = self.pipeline.processor.load_image(image_path), None
+        if not image:
+            return None
+
+        # Resize + Blur + Border + Watermark, each stage once
+        processed, layout_info = self.pipeline.render(image, settings, exif_data,
+                                                      render_scale=render_scale, cancel=cancel,
+                                                      overlay_watermark=True, profiler=profiler)
+        if cancel():
+            return None
+
+        overlay = None
+        if layout_info.get('watermark'):
+            sprite, position, origin = layout_info['watermark']
+            overlay = {
+                'image': pil_to_qimage(sprite),
+                'position': position, # preview pixels
+                # Text block origin in full-resolution pixels (manual position)
+                'origin': (round(origin[0] / render_scale), round(origin[1] / render_scale)),
+                'render_scale': render_scale
+            }
+        return pil_to_qimage(processed), overlay, profiler.timings
 
 class SaveWorker(QThread):
     finished = pyqtSignal(bool, str) # success, message
     
-    def __init__(self, image, file_path, quality=95):
+    def __init__(self, image_path, settings, file_path, source_cache=None):
         super().__init__()
-        self.image = image
+        self.image_path = image_path
+        # Snapshot: the UI may keep editing while we export
+        self.settings = settings.snapshot()
         self.file_path = file_path
-        self.quality = quality
+        self.source_cache = source_cache
         
     def run(self):
         try:
-            ext = os.path.splitext(self.file_path)[1].lower()
-            if ext in ['.jpg', '.jpeg']:
-                self.image.save(self.file_path, quality=self.quality)
+            # The preview is a proxy; export always renders at full resolution
+            if self.source_cache:
+                image, exif_data = self.source_cache.get(self.image_path)
             else:
-                self.image.save(self.file_path)
+                image, exif_data = ImageProcessor().load_image(self.image_path), None
+            if not image:
+                raise IOError(f"无法读取图片: {self.image_path}")
+
+            processed, _ = RenderPipeline().render(image, self.settings, exif_data)
+            save_image(processed, self.file_path, self.settings.export_quality)
             self.finished.emit(True, self.file_path)
         except Exception as e:
             self.finished.emit(False, str(e))
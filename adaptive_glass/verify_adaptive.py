@@ -1,7 +1,7 @@
 import sys
 import os
 from PIL import Image
-from src.core.processor import ImageProcessor
+from src.core.pipeline import RenderPipeline
 from src.core.utils import ProcessingSettings, Ratio
 
 def create_test_image(width, height, name):
@@ -9,7 +9,7 @@ def create_test_image(width, height, name):
     return img
 
 def verify_adaptive():
-    processor = ImageProcessor()
+    pipeline = RenderPipeline()
     settings = ProcessingSettings()
     
     print("开始验证自适应比例处理...")
@@ -19,7 +19,7 @@ def verify_adaptive():
     print("\n测试用例 1: 原图宽于目标 (16:9 -> 1:1)")
     img_wide = create_test_image(1600, 900, "wide")
     settings.target_ratio = Ratio.R_1_1
-    res_wide = processor.process(img_wide, settings)
+    res_wide, _ = pipeline.render(img_wide, settings)
     
     expected_size = (1600, 1600)
     if res_wide.size == expected_size:
@@ -40,7 +40,7 @@ def verify_adaptive():
     print("\n测试用例 2: 原图窄于目标 (4:3 -> 16:9)")
     img_narrow = create_test_image(800, 600, "narrow")
     settings.target_ratio = Ratio.R_16_9
-    res_narrow = processor.process(img_narrow, settings)
+    res_narrow, _ = pipeline.render(img_narrow, settings)
     
     # 600 height -> width should be 600 * 16/9 = 1066.66 -> 1066
     expected_w = int(600 * 16 / 9)
@@ -57,7 +57,7 @@ def verify_adaptive():
     # Input 1:1 (800x800) -> Should become 9:16?
     # 800 width -> height 800 * 16/9 = 1422
     img_square = create_test_image(800, 800, "square")
-    res_vertical = processor.process(img_square, settings)
+    res_vertical, _ = pipeline.render(img_square, settings)
     
     expected_h = int(800 * 16 / 9)
     expected_size_3 = (800, expected_h)
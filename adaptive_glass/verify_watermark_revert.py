@@ -1,14 +1,14 @@
 import sys
 import os
 from PIL import Image
-from src.core.processor import ImageProcessor
+from src.core.pipeline import RenderPipeline
 from src.core.utils import ProcessingSettings, WatermarkSettings
 
 def verify_watermark():
     print("开始验证水印模块还原...")
     
     # 1. Setup
-    processor = ImageProcessor()
+    pipeline = RenderPipeline()
     settings = ProcessingSettings()
     settings.watermark.enabled = True
     settings.watermark.text = "Test Watermark"
@@ -26,7 +26,7 @@ def verify_watermark():
     # 3. Process
     try:
         print("正在处理带水印的图片...")
-        res, layout = processor.process(img, settings)
+        res, layout = pipeline.render(img, settings)
         
         if res:
             print("PASS: 图片处理成功，未发生崩溃。")